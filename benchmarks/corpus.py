@@ -0,0 +1,245 @@
+import argparse
+import random
+from pathlib import Path
+
+# Names that make up the identifiers of the generated code
+words = ["item", "value", "count", "name", "data", "index", "result", "buffer", "entry", "node", "total", "state"]
+# Number of generated files per subdirectory
+files_per_directory = 50
+
+
+class SourceGenerator:
+    """
+    Generates deterministic synthetic source code files for benchmarking.
+    Every file is generated from a random number generator seeded with the seed, the language and the file's index,
+    so a file's content only depends on these and the corpus parameters.
+    The lines of each file are divided evenly among its functions, whose bodies consist of simple statements
+    and compound statements nested up to depth levels deep. Each block starts with a logging statement
+    with probability logging.
+    """
+
+    suffix = None
+
+    def __init__(self, functions: int = 10, file_size: int = 300, depth: int = 4, logging: float = 0.1,
+                 seed: int = 0):
+        """
+        :param functions: number of functions per file
+        :param file_size: approximate number of lines per file
+        :param depth: maximum nesting depth of blocks inside a function
+        :param logging: probability of a block to contain a logging statement
+        :param seed: seed of the random number generators
+        """
+        self.functions = functions
+        # Lines of each function's body, leaving lines for the function's head and return statement
+        self.function_lines = max(1, file_size // max(1, functions) - 3)
+        self.depth = depth
+        self.logging = logging
+        self.seed = seed
+        self.rng = None
+
+    def identifier(self) -> str:
+        return self.rng.choice(words) + str(self.rng.randrange(10))
+
+    def block(self, budget: int, depth: int, indent: int) -> list:
+        """Returns the lines of a block of about budget lines, starting with a logging statement
+        with probability self.logging"""
+        lines = []
+        if self.rng.random() < self.logging:
+            lines.append(self.indent(indent) + self.logging_statement())
+        lines += self.statements(max(1, budget - len(lines)), depth, indent)
+        return lines
+
+    def statements(self, budget: int, depth: int, indent: int) -> list:
+        """Returns about budget lines of statements, some of them compound statements if depth allows"""
+        lines = []
+        while budget > 0:
+            if depth < self.depth and budget >= 4 and self.rng.random() < 0.3:
+                # Leave lines for the statement's head and closing line
+                compound = self.compound_statement(self.rng.randint(1, budget - 2), depth + 1, indent)
+                lines += compound
+                budget -= len(compound)
+            else:
+                lines.append(self.indent(indent) + self.simple_statement())
+                budget -= 1
+        return lines
+
+    def generate(self, index: int) -> str:
+        """Returns the source code of the file with the given index"""
+        self.rng = random.Random(f"{self.seed}:{self.suffix}:{index}")
+        return "\n".join(self.file_lines(index)) + "\n"
+
+    def file_name(self, index: int) -> Path:
+        return Path(f"dir_{index // files_per_directory:03}", f"Generated{index}{self.suffix}")
+
+    def indent(self, level: int) -> str:
+        return "    " * level
+
+    def logging_statement(self) -> str:
+        raise NotImplementedError
+
+    def simple_statement(self) -> str:
+        raise NotImplementedError
+
+    def compound_statement(self, budget: int, depth: int, indent: int) -> list:
+        raise NotImplementedError
+
+    def file_lines(self, index: int) -> list:
+        raise NotImplementedError
+
+
+class PythonGenerator(SourceGenerator):
+    suffix = ".py"
+
+    def logging_statement(self) -> str:
+        return f"logger.{self.rng.choice(['debug', 'info', 'warning', 'error'])}(\"%s\", {self.identifier()})"
+
+    def simple_statement(self) -> str:
+        kind = self.rng.randrange(4)
+        if kind == 0:
+            return f"{self.identifier()} = {self.identifier()}({self.identifier()}, {self.rng.randrange(100)})"
+        if kind == 1:
+            return f"self.{self.identifier()}.append({self.identifier()})"
+        if kind == 2:
+            return f"{self.identifier()} += len({self.identifier()})"
+        return f"{self.identifier()} = [x for x in {self.identifier()} if x]"
+
+    def compound_statement(self, budget: int, depth: int, indent: int) -> list:
+        head = self.indent(indent)
+        kind = self.rng.randrange(5)
+        if kind == 0:
+            lines = [f"{head}if {self.identifier()} > {self.rng.randrange(10)}:"]
+            if budget > 1 and self.rng.random() < 0.5:
+                lines += self.block(budget // 2, depth, indent + 1)
+                return lines + [f"{head}else:"] + self.block(budget - budget // 2, depth, indent + 1)
+            return lines + self.block(budget, depth, indent + 1)
+        if kind == 1:
+            return [f"{head}for {self.identifier()} in {self.identifier()}:"] + self.block(budget, depth, indent + 1)
+        if kind == 2:
+            return [f"{head}while {self.identifier()} < {self.identifier()}:"] + self.block(budget, depth, indent + 1)
+        if kind == 3:
+            return [f"{head}with open({self.identifier()}) as {self.identifier()}:"] + self.block(budget, depth,
+                                                                                                    indent + 1)
+        lines = [f"{head}try:"] + self.block(max(1, budget - 1), depth, indent + 1)
+        return lines + [f"{head}except ValueError as e:"] + self.block(1, depth, indent + 1)
+
+    def file_lines(self, index: int) -> list:
+        lines = ["import logging", "", "logger = logging.getLogger(__name__)", "", "",
+                 f"class Generated{index}:"]
+        for function in range(self.functions):
+            lines.append(f"    def method{function}(self, {self.identifier()}, {self.identifier()}):")
+            lines += self.block(self.function_lines, 0, 2)
+            lines += [f"        return {self.identifier()}", ""]
+        return lines
+
+
+class JavaGenerator(SourceGenerator):
+    suffix = ".java"
+
+    def logging_statement(self) -> str:
+        return f"logger.{self.rng.choice(['debug', 'info', 'warn', 'error'])}(\"{{}}\", {self.identifier()});"
+
+    def simple_statement(self) -> str:
+        kind = self.rng.randrange(4)
+        if kind == 0:
+            return f"int {self.identifier()} = {self.identifier()}({self.identifier()}, {self.rng.randrange(100)});"
+        if kind == 1:
+            return f"{self.identifier()}.add({self.identifier()});"
+        if kind == 2:
+            return f"{self.identifier()} += {self.identifier()}.length();"
+        return f"{self.identifier()} = {self.identifier()} == null ? 0 : {self.identifier()}.size();"
+
+    def compound_statement(self, budget: int, depth: int, indent: int) -> list:
+        head = self.indent(indent)
+        kind = self.rng.randrange(5)
+        if kind == 0:
+            lines = [f"{head}if ({self.identifier()} > {self.rng.randrange(10)}) {{"]
+            if budget > 1 and self.rng.random() < 0.5:
+                lines += self.block(budget // 2, depth, indent + 1)
+                lines += [f"{head}}} else {{"] + self.block(budget - budget // 2, depth, indent + 1)
+            else:
+                lines += self.block(budget, depth, indent + 1)
+        elif kind == 1:
+            lines = [f"{head}for (int i{depth} = 0; i{depth} < {self.identifier()}; i{depth}++) {{"]
+            lines += self.block(budget, depth, indent + 1)
+        elif kind == 2:
+            lines = [f"{head}while ({self.identifier()} < {self.identifier()}) {{"]
+            lines += self.block(budget, depth, indent + 1)
+        elif kind == 3:
+            lines = [f"{head}for (String {self.identifier()} : {self.identifier()}) {{"]
+            lines += self.block(budget, depth, indent + 1)
+        else:
+            lines = [f"{head}try {{"] + self.block(max(1, budget - 1), depth, indent + 1)
+            lines += [f"{head}}} catch (IllegalStateException e) {{"] + self.block(1, depth, indent + 1)
+        return lines + [f"{head}}}"]
+
+    def file_lines(self, index: int) -> list:
+        lines = ["import org.slf4j.Logger;", "import org.slf4j.LoggerFactory;", "",
+                 f"public class Generated{index} {{",
+                 f"    private static final Logger logger = LoggerFactory.getLogger(Generated{index}.class);", ""]
+        for function in range(self.functions):
+            lines.append(f"    public int method{function}(int {self.identifier()}, String {self.identifier()}) {{")
+            lines += self.block(self.function_lines, 0, 2)
+            lines += [f"        return {self.identifier()};", "    }", ""]
+        return lines + ["}"]
+
+
+generators = {
+    "python": PythonGenerator,
+    "java": JavaGenerator,
+}
+
+
+def generate_corpus(path: Path, language: str, files: int = 100, **parameters) -> list:
+    """
+    Writes a synthetic corpus of the language's source code files below path.
+    :param path: output directory, the files are written to subdirectories of at most 50 files each
+    :param language: language of the files
+    :param files: number of files
+    :param parameters: further parameters of the SourceGenerator
+    :return: list of the written files
+    """
+    generator = generators[language](**parameters)
+    written = []
+    for index in range(files):
+        file = Path(path) / generator.file_name(index)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(generator.generate(index), encoding="utf8")
+        written.append(file)
+    return written
+
+
+def add_corpus_arguments(arg_parser: argparse.ArgumentParser):
+    """Adds the options of the corpus parameters to a command line parser"""
+    arg_parser.add_argument("-n", "--files", type=int, default=200,
+                            help="Number of files per language.")
+    arg_parser.add_argument("--file-size", type=int, default=300,
+                            help="Approximate number of lines per file.")
+    arg_parser.add_argument("--functions", type=int, default=10,
+                            help="Number of functions per file.")
+    arg_parser.add_argument("--depth", type=int, default=4,
+                            help="Maximum nesting depth of blocks inside functions.")
+    arg_parser.add_argument("--logging", type=float, default=0.1,
+                            help="Probability of a block to contain a logging statement.")
+    arg_parser.add_argument("--seed", type=int, default=0,
+                            help="Seed of the generated code. The same parameters and seed give the same files.")
+
+
+def corpus_parameters(settings) -> dict:
+    """Returns the SourceGenerator parameters of parsed command line arguments"""
+    return {"functions": settings.functions, "file_size": settings.file_size, "depth": settings.depth,
+            "logging": settings.logging, "seed": settings.seed}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generates a deterministic synthetic corpus of source code files.")
+    arg_parser.add_argument("output", type=Path, help="Output directory.")
+    arg_parser.add_argument("-l", "--language", type=str, choices=list(generators), required=True,
+                            help="Language of the generated files.")
+    add_corpus_arguments(arg_parser)
+    settings = arg_parser.parse_args()
+    if settings.files < 1 or settings.functions < 1 or settings.file_size < 1 or settings.depth < 0:
+        arg_parser.error("The number of files and functions, the file size and the depth must be positive.")
+    if not 0 <= settings.logging <= 1:
+        arg_parser.error("The logging density must be between 0 and 1.")
+    written = generate_corpus(settings.output, settings.language, settings.files, **corpus_parameters(settings))
+    print(f"Wrote {len(written)} files to {settings.output}")
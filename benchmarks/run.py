@@ -0,0 +1,248 @@
+import argparse
+import importlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+from benchmarks.corpus import add_corpus_arguments, corpus_parameters, generate_corpus, generators
+
+repo_dir = Path(__file__).resolve().parent.parent
+modes = ["extract", "train", "recommend"]
+
+
+def run_logcheck(args: list, cwd: Path) -> tuple:
+    """
+    Runs logcheck.py in a new process.
+    :param args: command line arguments of logcheck.py
+    :param cwd: working directory, where recommendation looks for the models
+    :return: wall time in seconds and peak resident set size in MB of the largest process, None where unavailable
+    """
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(repo_dir / "logcheck.py"), *map(str, args)], cwd=cwd,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+        if hasattr(os, "wait4"):
+            # The resource usage of the process includes that of its terminated worker processes
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in KB on Linux and in bytes on macOS
+            peak_rss = usage.ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+        else:
+            process.wait()
+            seconds = time.perf_counter() - start
+            peak_rss = None
+        if process.returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip().splitlines()[-20:]
+            raise RuntimeError(f"logcheck.py {' '.join(map(str, args))} failed:\n" + "\n".join(message))
+    return seconds, peak_rss
+
+
+def logcheck_args(mode: str, language: str, model: str, workers: int, corpus: Path, work_dir: Path) -> list:
+    """Returns the command line arguments of logcheck.py for a benchmark mode"""
+    common = ["-l", language, "-j", workers, "-f", "--profile", work_dir / "profile.json"]
+    if mode == "extract":
+        return ["-e", *common, "-o", work_dir / "features.csv", corpus]
+    if mode == "train":
+        # Recommendation uses the trained classifier, as the working directory is the work directory
+        return ["-t", *common, "-m", "rnd", "-o", work_dir / f"{language}_logging_classifier", corpus]
+    return [*common, "-m", model, "-o", work_dir / "recommendations.txt", corpus]
+
+
+def measure_stages(files: list, settings, models_dir: Path) -> tuple:
+    """
+    Runs the stages of extraction and recommendation one after the other for all files in this process and times them.
+    :param files: source code files
+    :param settings: logcheck settings, see benchmark_settings()
+    :param models_dir: directory holding the models for recommendation, None to skip prediction
+    :return: dict of seconds per stage and dict of the numbers of lines, bytes, blocks and blocks without logging
+    """
+    import logcheck
+    from inference import InferenceBatcher, load_predictor
+
+    LangExtractor = getattr(importlib.import_module(settings.language + "_extractor"),
+                            settings.language.capitalize() + "Extractor")
+    logcheck.init_worker(settings, LangExtractor, True)
+    stages = dict.fromkeys(["read", "parse", "extract", "encode"], 0.0)
+    counts = dict.fromkeys(["lines", "bytes", "blocks", "recommendation_blocks"], 0)
+    encoded = []
+    for file in files:
+        start = time.perf_counter()
+        src = logcheck.read_file(file)
+        read = time.perf_counter()
+        tree = logcheck.worker_state["parser"].parse(src)
+        parsed = time.perf_counter()
+        extractor = LangExtractor(src, logcheck.worker_state["tree_lang"], tree, file, settings)
+        param_vecs = extractor.fill_param_vectors(training=True)
+        extracted = time.perf_counter()
+        counts["blocks"] += len(param_vecs)
+        # Recommendation only predicts the blocks that don't contain logging yet
+        param_vecs = [par_vec for par_vec in param_vecs if not par_vec["contains_logging"]]
+        if param_vecs:
+            encoded.append(logcheck.encode_param_vecs(param_vecs))
+        encoded_time = time.perf_counter()
+        stages["read"] += read - start
+        stages["parse"] += parsed - read
+        stages["extract"] += extracted - parsed
+        stages["encode"] += encoded_time - extracted
+        counts["lines"] += src.count(b"\n")
+        counts["bytes"] += len(src)
+        counts["recommendation_blocks"] += len(param_vecs)
+    if models_dir is not None:
+        # The models are loaded relative to the working directory
+        cwd = os.getcwd()
+        os.chdir(models_dir)
+        try:
+            start = time.perf_counter()
+            batcher = InferenceBatcher(load_predictor(settings), settings.batch_size)
+            stages["load_model"] = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+        start = time.perf_counter()
+        for X in encoded:
+            batcher.add(None, X)
+        batcher.flush()
+        stages["predict"] = time.perf_counter() - start
+    return stages, counts
+
+
+def benchmark_settings(language: str, model: str, corpus: Path) -> argparse.Namespace:
+    """Returns logcheck settings with the defaults of its command line for the in-process stage measurements"""
+    return argparse.Namespace(path=corpus, language=language, model=model, train=False, extract=False, debug=False,
+                              alt=False, all=False, encode=False, engine="query", cache_dir=None, batch_size=4096,
+                              max_latency=None, profile=None)
+
+
+def benchmark_language(language: str, settings, corpus_dir: Path, work_dir: Path) -> dict:
+    """
+    Generates the language's corpus and benchmarks the modes of logcheck.py on it.
+    :param language: language of the corpus
+    :param settings: parsed command line arguments of the benchmark
+    :param corpus_dir: directory the corpus is written to
+    :param work_dir: directory for the outputs of logcheck.py
+    :return: report of the corpus, the in-process stage times and the runs of each mode and number of workers
+    """
+    from language_builder import create_ts_lang_obj
+
+    corpus = corpus_dir / language
+    files = generate_corpus(corpus, language, settings.files, **corpus_parameters(settings))
+    # Build the grammar beforehand, so the first run doesn't include the build
+    create_ts_lang_obj(language)
+    # Recommendation uses the classifier trained on the corpus if it is trained, the pre-trained models otherwise
+    models_dir = work_dir if "train" in settings.modes and settings.model == "rnd" else repo_dir
+    runs = []
+    for mode in settings.modes:
+        for workers in settings.workers:
+            cwd = models_dir if mode == "recommend" else work_dir
+            results = [run_logcheck(logcheck_args(mode, language, settings.model, workers, corpus, work_dir), cwd)
+                       for _ in range(settings.repeat)]
+            runs.append({
+                "mode": mode,
+                "workers": workers,
+                "seconds": [seconds for seconds, peak_rss in results],
+                "peak_rss_mb": max((peak_rss for seconds, peak_rss in results if peak_rss is not None), default=None),
+                # Stage times summed over the processes of the last run, see logcheck.py --profile
+                "stage_seconds": json.loads((work_dir / "profile.json").read_text())["stage_seconds"],
+            })
+    stages, counts = measure_stages(files, benchmark_settings(language, settings.model, corpus),
+                                    models_dir if "recommend" in settings.modes else None)
+    counts["files"] = len(files)
+    for run in runs:
+        seconds = median(run["seconds"])
+        # Training extracts all blocks, recommendation only those without logging
+        blocks = counts["recommendation_blocks"] if run["mode"] == "recommend" else counts["blocks"]
+        run["median_seconds"] = seconds
+        run["files_per_second"] = len(files) / seconds
+        run["blocks_per_second"] = blocks / seconds
+    return {"corpus": counts, "stages": stages, "runs": runs}
+
+
+def print_report(language: str, report: dict):
+    corpus = report["corpus"]
+    print(f"{language}: {corpus['files']} files, {corpus['lines']} lines, {corpus['blocks']} blocks, "
+          f"{corpus['recommendation_blocks']} without logging")
+    total = sum(report["stages"].values())
+    print(f"  {'stage (1 process)':<20}{'seconds':>10}{'share':>8}")
+    for stage, seconds in report["stages"].items():
+        print(f"  {stage:<20}{seconds:>10.3f}{seconds / total:>8.1%}")
+    print(f"  {'mode':<12}{'workers':>8}{'seconds':>10}{'files/s':>10}{'blocks/s':>11}{'peak RSS MB':>13}")
+    for run in report["runs"]:
+        peak_rss = f"{run['peak_rss_mb']:.1f}" if run["peak_rss_mb"] is not None else "-"
+        print(f"  {run['mode']:<12}{run['workers']:>8}{run['median_seconds']:>10.2f}{run['files_per_second']:>10.1f}"
+              f"{run['blocks_per_second']:>11.1f}{peak_rss:>13}")
+
+
+def logcheck_revision() -> dict:
+    """Returns the commit of the benchmarked code and whether tracked files have been modified"""
+    from git_diff import run_git
+
+    try:
+        commit = run_git(repo_dir, ["rev-parse", "HEAD"]).decode().strip()
+        modified = bool(run_git(repo_dir, ["status", "--porcelain", "--untracked-files=no"]).strip())
+    except RuntimeError:
+        return {"commit": None, "modified": None}
+    return {"commit": commit, "modified": modified}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmarks the extraction, training and recommendation "
+                                                     "throughput of logcheck.py on synthetic corpora.")
+    arg_parser.add_argument("-l", "--languages", type=str, nargs="+", choices=list(generators),
+                            default=list(generators), help="Languages to benchmark.")
+    arg_parser.add_argument("-m", "--model", type=str, choices=["rnd", "lstm"], default="rnd",
+                            help="Model for recommendation. Training always trains a random forest.")
+    arg_parser.add_argument("--modes", type=str, nargs="+", choices=modes, default=modes,
+                            help="Modes of logcheck.py to benchmark.")
+    arg_parser.add_argument("-j", "--workers", type=int, nargs="+",
+                            help="Numbers of worker processes to benchmark each mode with. "
+                                 "By default one and one per CPU.")
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3,
+                            help="Number of runs of each mode and number of workers. The median time is reported.")
+    arg_parser.add_argument("--corpus-dir", type=Path,
+                            help="Keep the generated corpus in this directory instead of a temporary one.")
+    arg_parser.add_argument("-o", "--output", type=Path,
+                            help="Also write the report as JSON to this file.")
+    add_corpus_arguments(arg_parser)
+    settings = arg_parser.parse_args()
+    if settings.files < 1 or settings.functions < 1 or settings.file_size < 1 or settings.depth < 0:
+        arg_parser.error("The number of files and functions, the file size and the depth must be positive.")
+    if not 0 <= settings.logging <= 1:
+        arg_parser.error("The logging density must be between 0 and 1.")
+    if settings.corpus_dir and settings.corpus_dir.exists() and any(settings.corpus_dir.iterdir()):
+        arg_parser.error("The corpus directory must be empty, as logcheck.py would also read older files in it.")
+    if settings.repeat < 1:
+        arg_parser.error("At least one run is required.")
+    settings.workers = sorted(set(settings.workers or [1, mp.cpu_count()]))
+    if settings.workers[0] < 1:
+        arg_parser.error("At least one worker process is required.")
+    # Train before recommending with the trained classifier
+    settings.modes = [mode for mode in modes if mode in settings.modes]
+
+    report = {
+        "logcheck": logcheck_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": mp.cpu_count(),
+        "model": settings.model,
+        "repeat": settings.repeat,
+        "corpus": {"files": settings.files, **corpus_parameters(settings)},
+        "languages": {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = settings.corpus_dir or Path(temp_dir, "corpus")
+        for language in settings.languages:
+            work_dir = Path(temp_dir, language)
+            work_dir.mkdir()
+            report["languages"][language] = benchmark_language(language, settings, corpus_dir.resolve(), work_dir)
+            print_report(language, report["languages"][language])
+    if settings.output:
+        with open(settings.output, "w") as f:
+            json.dump(report, f, indent=2)
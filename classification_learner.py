@@ -8,7 +8,9 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import recall_score, f1_score, precision_score, balanced_accuracy_score
 
-from config import reindex, supported_languages
+from config import supported_languages
+from feature_encoder import FeatureEncoder
+from forest import save_forest, forest_path
 from notebooks.notebook_helper import get_X_and_y_from_csv
 
 # if len(sys.argv) != 2:
@@ -16,13 +18,13 @@ from notebooks.notebook_helper import get_X_and_y_from_csv
 #     exit(1)
 
 arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("path", type=Path, help="The extract .csv file to learn on.")
+arg_parser.add_argument("path", type=Path, help="The extract .csv or .parquet file to learn on.")
 arg_parser.add_argument("-l", "--language", type=str, choices=supported_languages, help="Specify the language.")
 arg_parser.add_argument("-o", "--output", type=Path, help="Specify the output file.")
 settings = arg_parser.parse_args()
 
 if not settings.path.is_file():
-    arg_parser.error(".csv file does not exist.")
+    arg_parser.error("Extract file does not exist.")
 
 if not settings.language:
     arg_parser.error("Language must be specified via the -l argument.")
@@ -44,8 +46,7 @@ if not settings.output:
 # X = X.reindex(reindex[settings.language], fill_value=0, axis="columns")
 # y = df.contains_logging
 
-X, y = get_X_and_y_from_csv(settings.path)
-X = X.reindex(reindex[settings.language], fill_value=0, axis="columns")
+X, y = get_X_and_y_from_csv(settings.path, encoder=FeatureEncoder(settings.language))
 
 # Splitting the dataset into the Training set and Test set
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.1, stratify=y)
@@ -73,6 +74,8 @@ scores = [
 score_df = pd.DataFrame([scores], columns=score_names).mean().round(3)
 print(score_df)
 
-# Save the classifier
-pickle.dump(classifier, open(settings.output, 'wb'))
-print(f"Created and saved classifier {settings.output}")
+# Save the classifier, and its export for recommendations without scikit-learn
+with open(settings.output, 'wb') as output:
+    pickle.dump(classifier, output)
+save_forest(classifier, forest_path(settings.output), settings.output)
+print(f"Created and saved classifier {settings.output} and {forest_path(settings.output)}")
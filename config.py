@@ -318,6 +318,7 @@ parameter_vectors = {
 # Reindex
 ###############################################
 # List of parameter vecotor keys with onehot values expanded for reindexing the parameter vector during prediction
+# These are the input columns of the classifiers in order, see feature_encoder.FeatureEncoder
 # Assumption: num_children used; num_siblings, num_cousins, depth_from_def, depth_from_root, grandparent NOT used
 # TODO: Create automatically
 
@@ -387,8 +388,11 @@ java_reindex = [
     'parent_object_creation_expression', 'parent_switch_block',
     'parent_switch_block_statement_group', 'parent_switch_rule',
     'parent_synchronized_statement', 'parent_try_statement',
-    'parent_try_with_resources_statement', 'parent_while_statement'
-    'parent_argument_list',
+    'parent_try_with_resources_statement',
+    # A missing comma between 'parent_while_statement' and 'parent_argument_list' fused them into this single
+    # column when the pre-trained models were built. It is kept so the columns match the models,
+    # meaning that neither of the two parents is one-hot encoded.
+    'parent_while_statementparent_argument_list',
     'parent_array_initializer',
     'parent_assignment_expression',
     'parent_binary_expression',
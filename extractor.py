@@ -1,9 +1,11 @@
 import logging
-from copy import copy
+import sys
+import time
 
 from tree_sitter import Language, Tree, Node, TreeCursor
 
 # TODO: General config
+import profiler
 from config import parameter_vectors, node_dicts, node_names, keywords
 
 
@@ -43,20 +45,194 @@ def traverse_sub_tree(root_node: Node, stop_node: Node = None):
                 retracing = False
 
 
+def traverse_named_sub_tree(root_node: Node):
+    """Traverses the sub-ast of the given root node in pre-order and yields the named nodes and their depths.
+    Anonymous nodes are always leaves, so the order of the named nodes is the same as in traverse_sub_tree()."""
+    stack = [(root_node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if node.is_named:
+            yield node, depth
+        if node.child_count:
+            # Push the children in reverse to pop them in pre-order
+            children = node.named_children
+            children.reverse()
+            stack.extend((child, depth + 1) for child in children)
+
+
+class FunctionContext:
+    """The context token stream of a function definition, shared by all of its blocks.
+    The context of a block consists of the tokens of the function's nodes in pre-order up to and including the block,
+    followed by the tokens of the block's sub-ast. Both parts are slices of the function's token stream,
+    so the stream is computed once and each block's context is taken from offsets into it.
+    Nodes are only walked and encoded as far as the contexts requested so far reach."""
+
+    def __init__(self, def_node: Node, get_token, error_type: str):
+        """
+        :param def_node: The function definition node
+        :param get_token: Callable returning a named node's context token or None
+        :param error_type: Tree-sitter's node type name for syntax errors
+        """
+        self.error_type = error_type
+        self.walk = traverse_named_sub_tree(def_node)
+        self.get_token = get_token
+        # Named nodes of the function in pre-order, their depths and their pre-order indices by node id
+        self.nodes = []
+        self.depths = []
+        self.index = {}
+        self.walk_done = False
+        # Tokens of the first len(token_counts) - 1 nodes, token_counts[k] being the number of tokens of nodes [0, k)
+        self.tokens = []
+        self.token_counts = [0]
+        # Index of the first error node's token
+        self.first_error = None
+
+    def walk_until(self, count: int) -> bool:
+        """Walks the function until at least count nodes are known. Returns False if the function is exhausted"""
+        while len(self.nodes) < count:
+            if self.walk_done:
+                return False
+            try:
+                node, depth = next(self.walk)
+            except StopIteration:
+                self.walk_done = True
+                return False
+            self.index[node.id] = len(self.nodes)
+            self.nodes.append(node)
+            self.depths.append(depth)
+        return True
+
+    def encode_until(self, end: int):
+        """Computes the tokens of the nodes [0, end)"""
+        for k in range(len(self.token_counts) - 1, end):
+            token = self.get_token(self.nodes[k])
+            if token is not None:
+                if self.nodes[k].type == self.error_type and self.first_error is None:
+                    self.first_error = len(self.tokens)
+                self.tokens.append(token)
+            self.token_counts.append(len(self.tokens))
+
+    def context_of(self, block_node: Node, debug: bool = False):
+        """Returns the context of the block and whether it contains an error node"""
+        # Find the block's pre-order index
+        while block_node.id not in self.index:
+            if not self.walk_until(len(self.nodes) + 1):
+                raise RuntimeError(f"Block {block_node} not found in its function definition")
+        start = self.index[block_node.id]
+        # The block's sub-ast ends before the next node that isn't deeper than the block
+        end = start + 1
+        while self.walk_until(end + 1) and self.depths[end] > self.depths[start]:
+            end += 1
+        self.encode_until(end)
+        context = self.tokens[:self.token_counts[start + 1]]
+        # Debug
+        if debug:
+            context.append("%%%%")
+        context.extend(self.tokens[self.token_counts[start]:self.token_counts[end]])
+        contains_error = self.first_error is not None and self.first_error < self.token_counts[end]
+        return "".join(context), contains_error
+
+
+# Compiled tree-sitter queries shared by all extractors of a process, keyed by language name and query source
+compiled_queries = {}
+
+
+def get_query(lang: Language, query_str: str):
+    """Returns the compiled query for the language, compiling it only on first use"""
+    key = (lang.name, query_str)
+    if key not in compiled_queries:
+        compiled_queries[key] = lang.query(query_str)
+    return compiled_queries[key]
+
+
+# Column index of each feature of the languages' parameter vectors
+feature_indices = {
+    language: {feature: index for index, feature in enumerate(vector)}
+    for language, vector in parameter_vectors.items()
+}
+# Default feature values of the languages' parameter vectors in column order
+default_rows = {language: list(vector.values()) for language, vector in parameter_vectors.items()}
+
+
+class ParameterVector:
+    """Fixed-schema parameter vector of a block.
+    The feature values are kept in a list in the column order of config.parameter_vectors and are accessed by
+    feature name like a dict. Features that aren't part of the language's schema raise a KeyError.
+    Pickles as the language name and the list of values, so shipping vectors back from pool workers
+    doesn't repeat the feature names for every block."""
+    __slots__ = ("language", "indices", "row")
+
+    def __init__(self, language: str, row: list = None):
+        self.language = language
+        self.indices = feature_indices[language]
+        self.row = default_rows[language].copy() if row is None else row
+
+    def __getitem__(self, feature: str):
+        return self.row[self.indices[feature]]
+
+    def __setitem__(self, feature: str, value):
+        self.row[self.indices[feature]] = value
+
+    def __iter__(self):
+        return iter(self.row)
+
+    def __len__(self):
+        return len(self.row)
+
+    def __reduce__(self):
+        return ParameterVector, (self.language, self.row)
+
+    def keys(self):
+        return self.indices.keys()
+
+    def shifted(self, rows: int):
+        """Returns a copy whose location is moved down by the given number of rows"""
+        start, end = self["location"].split("-")
+        start_row, start_column = start.split(";")
+        end_row, end_column = end.split(";")
+        param_vec = ParameterVector(self.language, self.row.copy())
+        param_vec["location"] = f"{int(start_row) + rows};{start_column}-{int(end_row) + rows};{end_column}"
+        return param_vec
+
+    def values(self) -> list:
+        return self.row
+
+
+class AncestorFrame:
+    """Entry of the ancestor stack built by Extractor.collect_block_nodes_dfs().
+    Besides the node it holds what would otherwise be found by climbing the node's ancestors:
+    its depth below the root, the frames of the lowest containing block (or error) and the lowest function
+    definition at or above it, and whether it or any of its ancestors is an error node."""
+    __slots__ = ("node", "parent", "depth", "containing", "func_def", "error")
+
+    def __init__(self, node: Node, parent, is_containing: bool, is_func_def: bool, is_error: bool):
+        self.node = node
+        self.parent = parent
+        if parent is None:
+            self.depth = 0
+            self.containing = self if is_containing or is_error else None
+            self.func_def = self if is_func_def else None
+            self.error = is_error
+        else:
+            self.depth = parent.depth + 1
+            self.containing = self if is_containing or is_error else parent.containing
+            self.func_def = self if is_func_def else parent.func_def
+            self.error = is_error or parent.error
+
+
 class Extractor:
-    def __init__(self, src: str, lang: Language, tree: Tree, file, settings):
+    def __init__(self, src: bytes, lang: Language, tree: Tree, file, settings):
         """
-        :param src: Source code to extract paramaeter vectors from
+        :param src: Source code to extract paramaeter vectors from, as bytes or a memory map of the file
         :param lang: Tree-sitter language object
         :param tree: Treesitter tree object
         :param file_path: Pathlib object of the file to analyze
         """
 
-        self.src: str = src
+        self.src: bytes = src
         self.lang: Language = lang
         self.tree: Tree = tree
         self.file = file
-        self.lines: list = src.splitlines()
         self.settings = settings
         # names is a dataclass containing Tree-Sitter's node type names for the current programming language
         # E.g. if self.settings.language == "python" then self.names.func_def == "function_definition"
@@ -65,12 +241,14 @@ class Extractor:
         self.keyword = keywords[self.settings.language]
         # A dict for encoding node types to ASCII chars to reduce size
         self.node_dict = node_dicts[self.settings.language]
-        # Parameter vector dict for feature extraction
-        self.parameter_vector = parameter_vectors[self.settings.language]
         # The parsed source code files can contain syntax errors. If a syntax error is discovered during processing of
         # a block, this flag will be raised resulting in the block being discarded.
         self.error_detected = False
         self.visited_nodes = set()
+        # Shared context token streams of the function definitions by node id
+        self.function_contexts = {}
+        # Ancestor frames of all nodes by node id, filled by the depth-first extraction engine (--engine dfs)
+        self.frames = {}
         self.logger = logging.getLogger(self.settings.language.capitalize() + "Extractor")
         # self.logger.setLevel(logging.DEBUG)
         # Debugging unhandled nodes
@@ -99,13 +277,21 @@ class Extractor:
         if self.settings.encode or encode:
             return self.node_dict[key]
         else:
-            return key
+            # Interned so that the repeated type names of a file's parameter vectors are pickled only once
+            return sys.intern(key)
 
     def find_containing_block(self, node: Node):
         """Returns the lowest block node containing the node."""
         if node.type in [self.names.root, self.names.error]:
             self.error_detected = True
             return node
+        # Look up the answer in the ancestor stack of the depth-first walk if there was one
+        frame = self.frames.get(node.id)
+        if frame is not None:
+            containing_block = frame.parent.containing.node
+            if containing_block.type == self.names.error:
+                self.error_detected = True
+            return containing_block
         parent = node.parent
         while parent is not None:
             if parent.type in self.names.containing_block_types + [self.names.root]:
@@ -118,7 +304,7 @@ class Extractor:
             debug_str = self.debug_helper(node)
             raise RuntimeError(f"Could not find containing block\n{debug_str}")
 
-    def build_context_of_block_node(self, block_node: Node, param_vec: dict):
+    def build_context_of_block_node(self, block_node: Node, param_vec: ParameterVector):
         """Build the context of the block and computes depth features"""
 
         # When looping over all blocks there might not be a function definition ancestor
@@ -129,23 +315,35 @@ class Extractor:
         # Find the containing (function) definition
         def_node = None
         depth_from_def = -1
-        looking_for_def = True
-        climbing_node = block_node.parent
-        # Measure the depth of nesting from the node's containing func/class def or module
-        # Remains 0 if the given block node is the child of a function definition
-        depth_from_root = 0
-        while climbing_node.type != self.names.root:
-            # Stop when encountering an error
-            if climbing_node.type == self.names.error:
+        frame = self.frames.get(block_node.id)
+        # Read the depths from the ancestor stack of the depth-first walk if there was one
+        if frame is not None:
+            parent_frame = frame.parent
+            if parent_frame.error:
                 self.error_detected = True
                 return
-            # Note the height until enclosing function definition
-            if looking_for_def and climbing_node.type == self.names.func_def:
-                looking_for_def = False
-                def_node = climbing_node
-                depth_from_def = depth_from_root
-            climbing_node = climbing_node.parent
-            depth_from_root += 1
+            if parent_frame.func_def is not None:
+                def_node = parent_frame.func_def.node
+                depth_from_def = parent_frame.depth - parent_frame.func_def.depth
+            depth_from_root = parent_frame.depth
+        else:
+            looking_for_def = True
+            climbing_node = block_node.parent
+            # Measure the depth of nesting from the node's containing func/class def or module
+            # Remains 0 if the given block node is the child of a function definition
+            depth_from_root = 0
+            while climbing_node.type != self.names.root:
+                # Stop when encountering an error
+                if climbing_node.type == self.names.error:
+                    self.error_detected = True
+                    return
+                # Note the height until enclosing function definition
+                if looking_for_def and climbing_node.type == self.names.func_def:
+                    looking_for_def = False
+                    def_node = climbing_node
+                    depth_from_def = depth_from_root
+                climbing_node = climbing_node.parent
+                depth_from_root += 1
         assert def_node is not None
         assert depth_from_def != -1
         param_vec["depth_from_def"] = depth_from_def
@@ -155,31 +353,32 @@ class Extractor:
         if not (self.settings.alt or self.settings.model == "lstm"):
             return
 
-        def add_relevant_node(node: Node, context: list):
-            """Adds the node to the context unless it is a logging statement"""
-            if node.is_named:
-                if node.type in self.names.most_node_types:
-                    if node.type == self.names.func_call:
-                        func_call_str = self.get_func_call_str(node)
-                        if self.keyword.match(func_call_str):
-                            return
-                    context.append(self.get_node_type(node, encode=True))
-                else:
-                    pass
-                    # Finds obscure node types
-                    # self.unhandled_node_types.add(node.type)
-
-        context = []
-        # Add the ast nodes that came before the block in its parent (func|class) def or module
-        for node in traverse_sub_tree(def_node, block_node):
-            add_relevant_node(node, context)
-        # Debug
-        if self.settings.debug:
-            context.append("%%%%")
-        # Add the ast nodes in the block and it's children
-        for node in traverse_sub_tree(block_node):
-            add_relevant_node(node, context)
-        param_vec["context"] = "".join(context)
+        # The token stream of the function definition is shared by all of its blocks
+        function_context = self.function_contexts.get(def_node.id)
+        if function_context is None:
+            function_context = FunctionContext(def_node, self.get_context_token, self.names.error)
+            self.function_contexts[def_node.id] = function_context
+        start = time.perf_counter() if profiler.current is not None else None
+        context, contains_error = function_context.context_of(block_node, self.settings.debug)
+        if start is not None:
+            profiler.current.add_time("context", time.perf_counter() - start)
+        # Error nodes in the context are discovered as if the context had been encoded node by node
+        if contains_error:
+            self.error_detected = True
+        param_vec["context"] = context
+
+    def get_context_token(self, node: Node):
+        """Returns the encoded type of a named node for the context, or None if the node isn't part of the context.
+        Logging statements are left out of the context."""
+        if node.type in self.names.most_node_types:
+            if node.type == self.names.func_call:
+                func_call_str = self.get_func_call_str(node)
+                if self.keyword.match(func_call_str):
+                    return None
+            return self.node_dict[node.type]
+        # Finds obscure node types
+        # self.unhandled_node_types.add(node.type)
+        return None
 
     def process_block_node(self, block_node: Node, training: bool, param_vectors: list):
         """Gathers information about the block in a parameter vector and enters it into the list of parameter vectors"""
@@ -191,7 +390,7 @@ class Extractor:
         else:
             self.visited_nodes.add(check_value)
         # Create a parameter vector for the block node and enter some information
-        param_vec = copy(self.parameter_vector)
+        param_vec = ParameterVector(self.settings.language)
         param_vec["location"] = f"{block_node.start_point[0]};{block_node.start_point[1]}-" \
                                 f"{block_node.end_point[0]};{block_node.end_point[1]}"
         # Add +2 instead because the block lacks the parent's line?
@@ -213,52 +412,147 @@ class Extractor:
         #     self.logger.error("Found logging in a block whose containing block is already root:")
         #     self.debug_helper(block_node.parent)
 
-        if training:
-            param_vec_list = list(param_vec.values())
-            # Check that no parameters have been accidentally added
-            if len(param_vec_list) != len(self.parameter_vector):
-                self.debug_helper(block_node)
-                print(self.parameter_vector.keys())
-                print(param_vec.keys())
-                raise RuntimeError("Parameter vector length mismatch")
-
-            # For extraction of features to a csv file, append a list of the values
-            if self.settings.extract:
-                param_vectors.append(param_vec_list)
-            # For classifier training, append the whole dict
-            else:
-                param_vectors.append(param_vec)
+        # For training and feature extraction all blocks are kept, for prediction only those without logging
+        if training or not param_vec["contains_logging"]:
+            param_vectors.append(param_vec)
+
+    def collect_block_groups(self) -> list:
+        """Finds the blocks to extract features from with a single query.
+        Blocks are processed grouped by their outermost function definition (or all together with -x/--all)
+        and by block type in the order of self.names.block_types, so each block is only found once.
+        Returns a list of (outermost function definition, blocks in processing order) per group.
+        With -x/--all, the single group has no function definition."""
+        block_pattern = "[" + " ".join(f"({block_name})" for block_name in self.names.block_types) + "] @block"
+        type_order = {block_name: i for i, block_name in enumerate(self.names.block_types)}
+        # Loop over all blocks
+        profiler.count("queries")
+        if self.settings.all:
+            block_query = get_query(self.lang, block_pattern)
+            groups = [(None, [block_node for block_node, block_tag in block_query.captures(self.tree.root_node)])]
+            profiler.count("nodes", len(groups[0][1]))
+        # or only descendants of function definitions like Li et al.
         else:
-            # For prediction, the extracted parameters will be returned as a list of dicts for subsequent
-            # pandas.Dataframe creation
-            # Only recommend for a node that doesn't have logging already
-            if not param_vec["contains_logging"]:
-                param_vectors.append(param_vec)
+            block_query = get_query(self.lang, f"({self.names.func_def}) @funcdef " + block_pattern)
+            groups = []
+            group_start = group_end = -1
+            # Captures are in document order, so nested function definitions and their blocks
+            # fall into the group of the outermost function definition
+            captures = block_query.captures(self.tree.root_node)
+            profiler.count("nodes", len(captures))
+            for node, tag in captures:
+                node: Node
+                if tag == "funcdef":
+                    if node.start_byte >= group_end:
+                        groups.append((node, []))
+                        group_start, group_end = node.start_byte, node.end_byte
+                # Blocks of a function definition start after its name
+                elif group_start < node.start_byte and node.end_byte <= group_end:
+                    groups[-1][1].append(node)
+        # Stable sort by block type within each group
+        return [(def_node, sorted(group, key=lambda n: type_order[n.type])) for def_node, group in groups]
+
+    def collect_block_nodes(self) -> list:
+        """Returns the blocks to extract features from in processing order, see collect_block_groups()"""
+        return [block_node for def_node, group in self.collect_block_groups() for block_node in group]
+
+    def collect_block_nodes_dfs(self) -> list:
+        """Alternative to collect_block_nodes() for the depth-first extraction engine (--engine dfs).
+        Walks the whole tree once depth-first, keeping a stack of ancestor frames so that the containing blocks,
+        function definitions and depths of the blocks can be looked up later instead of climbing the tree.
+        Returns the same blocks in the same order as collect_block_nodes()."""
+        block_types = set(self.names.block_types)
+        containing_types = set(self.names.containing_block_types + [self.names.root])
+        type_order = {block_name: i for i, block_name in enumerate(self.names.block_types)}
+        groups = [[]] if self.settings.all else []
+        # Anonymous nodes are always leaves, so only named nodes can be blocks or their ancestors
+        stack = [(self.tree.root_node, None)]
+        visited = 1
+        while stack:
+            node, parent_frame = stack.pop()
+            node_type = node.type
+            if node_type in block_types:
+                if self.settings.all:
+                    groups[-1].append(node)
+                # Only descendants of function definitions
+                elif parent_frame is not None and parent_frame.func_def is not None:
+                    groups[-1].append(node)
+            # Blocks are grouped by their outermost function definition
+            elif node_type == self.names.func_def and not self.settings.all \
+                    and (parent_frame is None or parent_frame.func_def is None):
+                groups.append([])
+            elif not node.child_count:
+                continue
+            frame = AncestorFrame(node, parent_frame, node_type in containing_types,
+                                  node_type == self.names.func_def, node_type == self.names.error)
+            self.frames[node.id] = frame
+            # Push the children in reverse to pop them in pre-order
+            children = node.named_children
+            children.reverse()
+            stack.extend((child, frame) for child in children)
+            visited += len(children)
+        profiler.count("nodes", visited)
+        # Stable sort by block type within each group
+        return [block_node for group in groups for block_node in sorted(group, key=lambda n: type_order[n.type])]
 
     def fill_param_vectors(self, training: bool = True) -> list:
         """Extracts features from all blocks"""
         self.error_detected = False
         param_vectors = []
-        # Loop over all blocks
-        if self.settings.all:
-            for block_name in self.names.block_types:
-                block_query = self.lang.query(f"({block_name}) @block")
-                block_nodes = block_query.captures(self.tree.root_node)
-                for block_node, block_tag in block_nodes:
-                    block_node: Node
-                    self.process_block_node(block_node, training, param_vectors)
-        # or only descendants of function definitions like Li et al.
+        if self.settings.engine == "dfs":
+            block_nodes = self.collect_block_nodes_dfs()
         else:
-            func_def_query = self.lang.query(f"({self.names.func_def}) @funcdef")
-            func_def_nodes = func_def_query.captures(self.tree.root_node)
-            for funcdef_node, func_tag in func_def_nodes:
-                funcdef_node: Node
-                for block_name in self.names.block_types:
-                    block_query = self.lang.query(f"({block_name}) @block")
-                    block_nodes = block_query.captures(funcdef_node)
-                    for block_node, block_tag in block_nodes:
-                        block_node: Node
-                        self.process_block_node(block_node, training, param_vectors)
+            block_nodes = self.collect_block_nodes()
+        for block_node in block_nodes:
+            self.process_block_node(block_node, training, param_vectors)
+        # Nodes walked for the contexts
+        profiler.count("nodes", sum(len(context.nodes) for context in self.function_contexts.values()))
         if self.unhandled_node_types != set():
             self.logger.error(self.unhandled_node_types)
         return param_vectors
+
+    @staticmethod
+    def function_signature(def_node: Node) -> tuple:
+        """Identifies a function definition together with everything outside of it that the features of its blocks
+        depend on: its source code and column, and the types, numbers of named children and preceding siblings' types
+        of it and its ancestors. Blocks of function definitions with equal signatures have equal parameter vectors,
+        apart from the rows of their locations."""
+        ancestors = []
+        node = def_node
+        while node is not None:
+            prev_sibling = node.prev_sibling
+            ancestors.append((node.type, node.named_child_count, prev_sibling.type if prev_sibling else None))
+            node = node.parent
+        return def_node.text, def_node.start_point[1], tuple(ancestors)
+
+    def fill_param_vectors_incremental(self, training: bool, previous: dict):
+        """Like fill_param_vectors(), but reuses the parameter vectors of the function definitions
+        whose signature is found in the results of a previous extraction of the file.
+        With -x/--all, all blocks are extracted again.
+        :param training: whether blocks that already contain logging are kept
+        :param previous: results of a previous call, empty for the first extraction of a file
+        :return: the parameter vectors and the results of this extraction, mapping the signatures of the function
+        definitions to their parameter vectors, whether a syntax error had been detected after them and their row"""
+        self.error_detected = False
+        param_vectors = []
+        results = {}
+        for def_node, block_nodes in self.collect_block_groups():
+            # Once a syntax error has been detected, the blocks of all following groups are discarded
+            if self.error_detected:
+                break
+            signature = self.function_signature(def_node) if def_node is not None else None
+            if signature in previous:
+                group_param_vectors, self.error_detected, row = previous[signature]
+                # Move the locations along with the function definition
+                if row != def_node.start_point[0]:
+                    rows = def_node.start_point[0] - row
+                    group_param_vectors = [param_vec.shifted(rows) for param_vec in group_param_vectors]
+            else:
+                group_param_vectors = []
+                for block_node in block_nodes:
+                    self.process_block_node(block_node, training, group_param_vectors)
+            if signature is not None:
+                results[signature] = (group_param_vectors, self.error_detected, def_node.start_point[0])
+            param_vectors.extend(group_param_vectors)
+        if self.unhandled_node_types != set():
+            self.logger.error(self.unhandled_node_types)
+        return param_vectors, results
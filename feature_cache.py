@@ -0,0 +1,120 @@
+import hashlib
+import os
+import pickle
+import sys
+from pathlib import Path
+
+from language_builder import build_dir, read_manifest
+
+# Modules whose source determines the extracted features besides the language's extractor module
+feature_modules = ["config", "extractor"]
+
+
+def extractor_version(language: str, LangExtractor) -> str:
+    """
+    Hash over the sources of the extraction code and the language's grammar build,
+    so cached features are invalidated whenever a change could alter them.
+    """
+    sha = hashlib.sha256()
+    for module_name in feature_modules + [LangExtractor.__module__]:
+        sha.update(Path(sys.modules[module_name].__file__).read_bytes())
+    sha.update(read_manifest(build_dir / f"{language}.json").get("hash", "").encode("utf8"))
+    return sha.hexdigest()
+
+
+class FeatureCache:
+    """
+    On-disk cache of the parameter vectors of source files.
+    Entries are addressed by a hash of the file's content, the language, the extractor version and the settings that
+    change the features, so renamed or copied files hit the same entry and changed files never hit a stale one.
+    Each entry is a pickle file that is written atomically, so concurrent workers and runs can share the cache.
+    Reading an entry updates its modification time, and evict() removes the least recently used entries.
+    """
+
+    def __init__(self, cache_dir: Path, settings, LangExtractor):
+        """
+        :param cache_dir: directory holding the cache entries
+        :param settings: parsed command line arguments
+        :param LangExtractor: the language's extractor class
+        """
+        self.cache_dir = Path(cache_dir)
+        # Everything besides the file content that the parameter vectors depend on
+        self.prefix = "\0".join([
+            settings.language,
+            extractor_version(settings.language, LangExtractor),
+            f"alt={settings.alt}",
+            # The contexts of the blocks are only built for context extraction and the neural network
+            f"context={settings.alt or settings.model == 'lstm'}",
+            f"all={settings.all}",
+            f"encode={settings.encode}",
+            f"debug={settings.debug}",
+        ]).encode("utf8")
+
+    def key(self, src: bytes, training: bool) -> str:
+        """Returns the cache key of a file's source code"""
+        sha = hashlib.sha256(self.prefix)
+        sha.update(b"\0training=1\0" if training else b"\0training=0\0")
+        sha.update(src)
+        return sha.hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str):
+        """Returns the cached parameter vectors or None if the key isn't cached"""
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                param_vecs = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return param_vecs
+
+    def put(self, key: str, param_vecs: list):
+        """Stores the parameter vectors of a file"""
+        path = self.entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(param_vecs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def evict(cache_dir: Path, max_size: int):
+    """
+    Removes the least recently used entries until the cache takes up at most max_size bytes.
+    :param cache_dir: directory holding the cache entries
+    :param max_size: maximum total size of the entries in bytes
+    """
+    if not Path(cache_dir).is_dir():
+        return
+    entries = []
+    total_size = 0
+    with os.scandir(cache_dir) as shards:
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            with os.scandir(shard.path) as shard_entries:
+                for entry in shard_entries:
+                    # Skip temporary files of entries that are being written
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total_size += stat.st_size
+    if total_size <= max_size:
+        return
+    entries.sort()
+    for mtime, size, path in entries:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        if total_size <= max_size:
+            break
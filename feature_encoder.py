@@ -0,0 +1,89 @@
+from string import ascii_letters
+
+import numpy as np
+
+from config import parameter_vectors, reindex
+
+# Categorical features that are one-hot encoded, their columns being prefixed with the feature name
+onehot_features = ["type", "parent"]
+# Integer of each letter of the ASCII encoded context
+context_letter_indices = {letter: index for index, letter in enumerate(ascii_letters)}
+
+
+class FeatureEncoder:
+    """
+    Encodes parameter vectors into the input matrix of the classifiers.
+    The columns are those of config.reindex in the same order, so the matrix matches the columns the models were
+    trained on. Numerical features are copied into their columns and type and parent are one-hot encoded into the
+    columns of their values. Values without a column, e.g. error nodes, are left all zero, the same as after
+    pandas.get_dummies() and reindexing.
+    The mapping from features to columns is computed once per language, after which encoding only
+    fills a preallocated matrix.
+    """
+
+    def __init__(self, language: str):
+        self.language = language
+        self.columns = reindex[language]
+        feature_index = {feature: index for index, feature in enumerate(parameter_vectors[language])}
+        # Numerical features and their columns
+        self.numerical_features = []
+        self.numerical_columns = []
+        # Column of each value of the one-hot encoded features
+        self.onehot_columns = {feature: {} for feature in onehot_features}
+        for column, name in enumerate(self.columns):
+            if name in feature_index:
+                self.numerical_features.append(name)
+                self.numerical_columns.append(column)
+                continue
+            for feature in onehot_features:
+                if name.startswith(feature + "_"):
+                    self.onehot_columns[feature][name[len(feature) + 1:]] = column
+                    break
+            else:
+                raise RuntimeError(f"Column {name} is neither a feature nor a one-hot encoded feature value")
+        # Positions of the used features in the parameter vectors' rows
+        self.row_indices = {feature: feature_index[feature] for feature in self.numerical_features + onehot_features}
+
+    def encode_columns(self, num_rows: int, get_column) -> np.ndarray:
+        """
+        Fills the input matrix from the feature columns.
+        :param num_rows: number of parameter vectors
+        :param get_column: function returning the values of a feature for all parameter vectors
+        :return: float32 matrix with one row per parameter vector and one column per entry of self.columns
+        """
+        X = np.zeros((num_rows, len(self.columns)), dtype=np.float32)
+        if not num_rows:
+            return X
+        for feature, column in zip(self.numerical_features, self.numerical_columns):
+            X[:, column] = get_column(feature)
+        rows = np.arange(num_rows)
+        for feature, value_columns in self.onehot_columns.items():
+            columns = np.fromiter((value_columns.get(value, -1) for value in get_column(feature)),
+                                  dtype=np.intp, count=num_rows)
+            known = columns >= 0
+            X[rows[known], columns[known]] = 1
+        return X
+
+    def encode(self, param_vecs: list) -> np.ndarray:
+        """Encodes a list of parameter vectors (or their lists of values) into the input matrix"""
+        # Transpose the rows into one tuple of values per feature
+        feature_columns = list(zip(*param_vecs))
+        return self.encode_columns(len(param_vecs), lambda feature: feature_columns[self.row_indices[feature]])
+
+    def encode_frame(self, df) -> np.ndarray:
+        """Encodes a pandas DataFrame of parameter vectors, e.g. a loaded extract, into the input matrix"""
+        return self.encode_columns(len(df), lambda feature: df[feature].to_numpy())
+
+    @staticmethod
+    def encode_contexts(contexts: list, max_length: int) -> np.ndarray:
+        """
+        Converts the ASCII encoded contexts into integer sequences for the LSTM's context input.
+        Like keras' pad_sequences(), longer sequences keep their last max_length integers
+        and shorter ones are padded with zeros at the front.
+        """
+        X = np.zeros((len(contexts), max_length), dtype=np.int32)
+        for row, context in enumerate(contexts):
+            context = [context_letter_indices[letter] for letter in str(context)][-max_length:]
+            if context:
+                X[row, max_length - len(context):] = context
+        return X
@@ -0,0 +1,367 @@
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger("Logcheck")
+
+# Directories of version control systems, which are never searched
+vcs_directories = {".git", ".hg", ".svn"}
+# Directories of installed dependencies and generated files, which are skipped unless ignore files are disabled.
+# Virtual environments are recognized by their pyvenv.cfg file.
+dependency_directories = {"node_modules", "__pycache__"}
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translates a gitignore pattern without its leading or trailing slash into a regular expression.
+    "*" and "?" don't match slashes, "**/" matches any number of directories and a trailing "/**" everything inside.
+    """
+    i, n = 0, len(pattern)
+    regex = []
+    while i < n:
+        char = pattern[i]
+        if char == "*":
+            if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+                if i + 2 == n:
+                    regex.append(".*")
+                    i += 2
+                    continue
+                if pattern[i + 2] == "/":
+                    regex.append("(?:.*/)?")
+                    i += 3
+                    continue
+            # Other consecutive asterisks are like a single one
+            while i + 1 < n and pattern[i + 1] == "*":
+                i += 1
+            regex.append("[^/]*")
+        elif char == "?":
+            regex.append("[^/]")
+        elif char == "[":
+            # A "]" directly after the opening bracket or its negation is part of the set
+            end = i + 1
+            if end < n and pattern[end] in "!^":
+                end += 1
+            if end < n and pattern[end] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end == -1:
+                regex.append(re.escape(char))
+            else:
+                chars = pattern[i + 1:end].replace("\\", "\\\\")
+                if chars[0] in "!^":
+                    chars = "^" + chars[1:]
+                regex.append(f"(?!/)[{chars}]")
+                i = end
+        elif char == "\\" and i + 1 < n:
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    return "".join(regex)
+
+
+class IgnorePatterns:
+    """
+    Patterns in the format of .gitignore files, matched against paths relative to a base directory.
+    Patterns without a slash apart from a trailing one match the name of a file or directory at any depth,
+    other patterns match the whole path. Patterns ending in a slash only match directories,
+    and patterns starting with "!" include what earlier patterns excluded. The last matching pattern decides.
+    """
+
+    def __init__(self, lines: list, base: str = ""):
+        """
+        :param lines: the patterns, blank lines and comments starting with "#" are skipped
+        :param base: directory the patterns are relative to, as a path relative to the walked tree's top
+        """
+        self.base = base
+        # (regex, whether the pattern includes instead of excludes, whether it only matches directories)
+        self.patterns = []
+        for line in lines:
+            line = line.rstrip("\n\r")
+            # Trailing spaces are removed unless escaped
+            stripped = line.rstrip(" ")
+            if stripped.endswith("\\") and len(stripped) < len(line):
+                stripped += " "
+            line = stripped
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate or line.startswith("\\!") or line.startswith("\\#"):
+                line = line[1:]
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            regex = translate_pattern(line.lstrip("/"))
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            self.patterns.append((re.compile(regex, re.DOTALL), negate, directory_only))
+
+    @classmethod
+    def read(cls, path: str, base: str = ""):
+        """Reads the patterns of an ignore file, returns None if it doesn't exist or contains no patterns"""
+        try:
+            with open(path, encoding="utf8", errors="replace") as f:
+                patterns = cls(f.readlines(), base)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return None
+        return patterns if patterns.patterns else None
+
+    def match(self, path: str, is_dir: bool):
+        """
+        :param path: path relative to the walked tree's top, using "/" as separator
+        :param is_dir: whether the path is a directory
+        :return: True if the path is excluded, False if it is included by a negated pattern, None if no pattern matches
+        """
+        if self.base:
+            path = path[len(self.base) + 1:]
+        for regex, negate, directory_only in reversed(self.patterns):
+            if directory_only and not is_dir:
+                continue
+            if regex.fullmatch(path):
+                return not negate
+        return None
+
+
+def is_ignored(ignore_files: list, path: str, is_dir: bool) -> bool:
+    """Returns whether the patterns of the ignore files, ordered from the top of the tree down, exclude the path"""
+    for patterns in reversed(ignore_files):
+        excluded = patterns.match(path, is_dir)
+        if excluded is not None:
+            return excluded
+    return False
+
+
+def repository_top(path: Path) -> Path:
+    """Returns the top directory of the git repository containing the directory, or the directory itself"""
+    for directory in [path, *path.parents]:
+        if (directory / ".git").exists():
+            return directory
+    return path
+
+
+class FileWalker:
+    """
+    Finds the source code files below a directory while walking it with os.scandir(), yielding each file as soon as
+    it is found, so work can start before the whole tree has been searched.
+    Honors .gitignore files, including those between the directory and the top of its git repository and the
+    repository's .git/info/exclude, skips directories of version control systems, installed dependencies
+    and virtual environments, and filters by user supplied include and exclude patterns and the file size.
+    Symbolic links to directories are followed, but no directory is searched twice, which also prevents loops.
+    """
+
+    def __init__(self, root: Path, suffix, include: list = None, exclude: list = None, ignore: bool = True,
+                 max_size: int = None):
+        """
+        :param root: directory to search
+        :param suffix: file extension of the files to find, or a tuple of file extensions
+        :param include: patterns in the format of .gitignore files relative to root, if given only files matching one
+        of them or inside a directory matching one are found
+        :param exclude: patterns in the format of .gitignore files relative to root of files and directories to skip,
+        which can't be included again by .gitignore files
+        :param ignore: whether .gitignore files are honored and dependency directories skipped
+        :param max_size: size in bytes above which files are skipped, None for no limit
+        """
+        self.root = Path(root)
+        self.suffix = suffix
+        self.include = IgnorePatterns(include) if include else None
+        self.exclude = IgnorePatterns(exclude) if exclude else None
+        self.ignore = ignore
+        self.max_size = max_size
+        # Paths are matched relative to the top of the repository, so its ignore files apply below root as well
+        self.top = repository_top(self.root.resolve()) if ignore else self.root.resolve()
+        self.root_prefix = self.root.resolve().relative_to(self.top).as_posix()
+        if self.root_prefix == ".":
+            self.root_prefix = ""
+        # Ignore files of the directories from the top down to root's parent
+        self.top_ignore_files = []
+        if ignore:
+            top_patterns = IgnorePatterns.read(str(self.top / ".git" / "info" / "exclude"))
+            self.top_ignore_files = [top_patterns] if top_patterns else []
+            directory, relative = self.top, ""
+            for part in Path(self.root_prefix).parts:
+                self.add_ignore_file(self.top_ignore_files, str(directory), relative)
+                directory = directory / part
+                relative = f"{relative}/{part}" if relative else part
+        # Ignore files read by accepts(), by directory
+        self.ignore_file_cache = {}
+        # Files skipped for their size, as (file, reason)
+        self.skipped = []
+
+    def add_ignore_file(self, ignore_files: list, directory: str, relative: str) -> list:
+        """Appends the patterns of the directory's .gitignore file to the list if it has one"""
+        patterns = IgnorePatterns.read(os.path.join(directory, ".gitignore"), relative)
+        if patterns:
+            ignore_files.append(patterns)
+        return ignore_files
+
+    def relative_to_root(self, relative: str) -> str:
+        """Converts a path relative to the top into one relative to root"""
+        return relative[len(self.root_prefix) + 1:] if self.root_prefix else relative
+
+    def skips_directory(self, name: str, path: str, relative: str, ignore_files: list) -> bool:
+        if name in vcs_directories:
+            return True
+        if self.exclude and self.exclude.match(self.relative_to_root(relative), True):
+            return True
+        if self.ignore:
+            if name in dependency_directories or os.path.isfile(os.path.join(path, "pyvenv.cfg")):
+                return True
+            if is_ignored(ignore_files, relative, True):
+                return True
+        return False
+
+    def skips_file(self, relative: str, ignore_files: list) -> bool:
+        relative_to_root = self.relative_to_root(relative)
+        if self.exclude and self.exclude.match(relative_to_root, False):
+            return True
+        if self.ignore and is_ignored(ignore_files, relative, False):
+            return True
+        if self.include:
+            # Files inside an included directory are included as well
+            parts = relative_to_root.split("/")
+            if not any(self.include.match("/".join(parts[:i]), i < len(parts)) for i in range(1, len(parts) + 1)):
+                return True
+        return False
+
+    def too_large(self, path: str, size: int) -> bool:
+        if self.max_size is not None and size > self.max_size:
+            logger.info(f"Skipping {path}, its size of {size} bytes exceeds the maximum file size")
+            self.skipped.append((path, f"its size of {size} bytes exceeds the maximum file size"))
+            return True
+        return False
+
+    def __iter__(self):
+        """Yields the files in the order of a depth-first search, the files of a directory before its subdirectories"""
+        return self.walk()
+
+    def walk(self, directory: Path = None, check_size: bool = True):
+        """
+        Yields the files below a directory like iterating over the walker, e.g. for the files of a new directory.
+        :param directory: root or a directory below it, None for root
+        :param check_size: whether files exceeding the maximum size are skipped and recorded, otherwise they are yielded
+        """
+        if directory is None or Path(directory).resolve() == self.root.resolve():
+            directory, relative, ignore_files = self.root, self.root_prefix, self.top_ignore_files
+        else:
+            relative = self.relative_to_top(directory)
+            if relative is None or not self.accepts_directory(directory):
+                return
+            # The directory's own ignore file is read when it is searched
+            ignore_files = self.directory_ignore_files(relative.split("/")[:-1])
+        try:
+            root_stat = os.stat(directory)
+        except OSError as e:
+            logger.warning(f"Can't search directory {directory}: {e}")
+            return
+        visited = {(root_stat.st_dev, root_stat.st_ino)}
+        # Directories to search, their paths relative to the top and the ignore files applying to them
+        stack = [(str(directory), relative, ignore_files)]
+        while stack:
+            directory, relative, ignore_files = stack.pop()
+            if self.ignore:
+                ignore_files = self.add_ignore_file(ignore_files.copy(), directory, relative)
+            try:
+                with os.scandir(directory) as entries:
+                    entries = list(entries)
+            except OSError as e:
+                logger.warning(f"Can't search directory {directory}: {e}")
+                continue
+            subdirectories = []
+            for entry in entries:
+                entry_relative = f"{relative}/{entry.name}" if relative else entry.name
+                try:
+                    if entry.is_dir():
+                        if not self.skips_directory(entry.name, entry.path, entry_relative, ignore_files):
+                            subdirectories.append((entry, entry_relative))
+                    elif entry.name.endswith(self.suffix) and entry.is_file():
+                        if not self.skips_file(entry_relative, ignore_files) and not (
+                                check_size and self.max_size is not None
+                                and self.too_large(entry.path, entry.stat().st_size)):
+                            yield Path(entry.path)
+                except OSError as e:
+                    logger.warning(f"Can't access {entry.path}: {e}")
+            for entry, entry_relative in reversed(subdirectories):
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    logger.warning(f"Can't access {entry.path}: {e}")
+                    continue
+                # Symbolic links can lead to a directory again
+                if (stat.st_dev, stat.st_ino) in visited:
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+                stack.append((entry.path, entry_relative, ignore_files))
+
+    def relative_to_top(self, path: Path):
+        """Returns the path relative to the top, or None if it isn't root or below it"""
+        try:
+            relative = Path(path).resolve().relative_to(self.top).as_posix()
+        except ValueError:
+            return None
+        if relative == ".":
+            relative = ""
+        if self.root_prefix and relative != self.root_prefix and not relative.startswith(self.root_prefix + "/"):
+            return None
+        return relative
+
+    def directory_ignore_files(self, parts: list):
+        """
+        Checks the directories from root down to the directory given by the parts of its path relative to the top.
+        :return: the ignore files applying inside the directory, None if the directory or one above it is skipped
+        """
+        ignore_files = self.top_ignore_files
+        directory = self.top
+        start = len(Path(self.root_prefix).parts) if self.root_prefix else 0
+        for i in range(start, len(parts)):
+            if self.ignore:
+                if str(directory) not in self.ignore_file_cache:
+                    self.ignore_file_cache[str(directory)] = self.add_ignore_file(
+                        ignore_files.copy(), str(directory), "/".join(parts[:i]))
+                ignore_files = self.ignore_file_cache[str(directory)]
+            directory = directory / parts[i]
+            if self.skips_directory(parts[i], str(directory), "/".join(parts[:i + 1]), ignore_files):
+                return None
+        if self.ignore:
+            if str(directory) not in self.ignore_file_cache:
+                self.ignore_file_cache[str(directory)] = self.add_ignore_file(
+                    ignore_files.copy(), str(directory), "/".join(parts))
+            ignore_files = self.ignore_file_cache[str(directory)]
+        return ignore_files
+
+    def accepts_directory(self, path: Path) -> bool:
+        """Returns whether a directory is root or would be searched, e.g. for watching the directories searched"""
+        relative = self.relative_to_top(path)
+        if relative is None:
+            return False
+        return self.directory_ignore_files(relative.split("/") if relative else []) is not None
+
+    def accepts(self, path: Path, size: int = None) -> bool:
+        """
+        Returns whether a file below root would be found, for files found otherwise, e.g. changed files.
+        :param path: the file
+        :param size: the file's size, if it isn't given and there is a maximum size, the file is checked on disk.
+        Files that can't be accessed, e.g. deleted files, aren't checked for their size.
+        """
+        relative = self.relative_to_top(path)
+        if not relative or relative == self.root_prefix:
+            return False
+        parts = relative.split("/")
+        # Check the directories between root and the file, collecting their ignore files
+        ignore_files = self.directory_ignore_files(parts[:-1])
+        if ignore_files is None:
+            return False
+        if self.skips_file(relative, ignore_files):
+            return False
+        if self.max_size is not None:
+            if size is None:
+                try:
+                    size = os.stat(path).st_size
+                except OSError:
+                    return True
+            if self.too_large(str(path), size):
+                return False
+        return True
@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+
+def breadth_first_order(tree) -> np.ndarray:
+    """
+    Returns the new index of each node of a scikit-learn tree when its nodes are renumbered breadth first,
+    which places the two children of every node next to each other
+    """
+    new_index = np.empty(tree.node_count, dtype=np.int64)
+    new_index[0] = 0
+    order = [0]
+    for node in order:
+        left = tree.children_left[node]
+        if left != -1:
+            right = tree.children_right[node]
+            new_index[left] = len(order)
+            new_index[right] = len(order) + 1
+            order += [left, right]
+    return new_index
+
+
+def export_forest(classifier) -> dict:
+    """
+    Flattens the trees of a fitted scikit-learn RandomForestClassifier into contiguous arrays over all nodes.
+    The nodes are renumbered so that the right child of each node directly follows its left child,
+    so a node's child is found with a single lookup. Leaves have themselves as child and an infinite threshold,
+    so evaluating a leaf any number of times stays on it.
+    Thresholds are rounded down to float32, which compares float32 inputs exactly like the float64 threshold.
+    Leaf values are normalized to class probabilities the same way the trees' predict_proba() normalizes them.
+    :param classifier: fitted single-output RandomForestClassifier
+    :return: dict of arrays, see CompiledForest
+    """
+    if classifier.n_outputs_ != 1:
+        raise RuntimeError("Only single-output forests can be exported")
+    trees = [estimator.tree_ for estimator in classifier.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+    num_nodes = offsets[-1]
+    feature = np.zeros(num_nodes, dtype=np.int32)
+    threshold = np.full(num_nodes, np.inf, dtype=np.float32)
+    child = np.empty(num_nodes, dtype=np.int32)
+    value = np.empty((num_nodes, classifier.n_classes_), dtype=np.float64)
+    for offset, tree in zip(offsets, trees):
+        index = breadth_first_order(tree) + offset
+        internal = tree.children_left != -1
+        feature[index[internal]] = tree.feature[internal]
+        tree_threshold = tree.threshold[internal]
+        rounded = tree_threshold.astype(np.float32)
+        threshold[index[internal]] = np.where(rounded > tree_threshold,
+                                              np.nextafter(rounded, np.float32(-np.inf)), rounded)
+        child[index[internal]] = index[tree.children_left[internal]]
+        child[index[~internal]] = index[~internal]
+        proba = tree.value[:, 0, :classifier.n_classes_].copy()
+        normalizer = proba.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        proba /= normalizer
+        value[index] = proba
+    return {
+        "feature": feature,
+        "threshold": threshold,
+        "child": child,
+        "value": value,
+        "roots": offsets[:-1].astype(np.int32),
+        "max_depth": np.array(max(tree.max_depth for tree in trees)),
+        "n_features": np.array(classifier.n_features_in_),
+        "classes": classifier.classes_,
+    }
+
+
+class CompiledForest:
+    """
+    Random forest evaluated with NumPy on the arrays of export_forest(), without scikit-learn.
+    All rows of a batch descend all trees at once, one tree level per step. Row and tree pairs that have reached
+    a leaf are dropped whenever they make up a good part of the remaining ones.
+    Predictions are identical to those of the exported classifier: inputs are compared as float32 values
+    like scikit-learn does, and the trees' probabilities are summed in tree order before averaging,
+    like RandomForestClassifier.predict_proba() does.
+    """
+
+    def __init__(self, arrays):
+        """
+        :param arrays: dict of arrays as returned by export_forest() or loaded from an exported file
+        """
+        # Indices are converted once, so that lookups don't convert them on every call
+        self.feature = arrays["feature"].astype(np.intp)
+        self.threshold = arrays["threshold"]
+        self.child = arrays["child"].astype(np.intp)
+        self.value = arrays["value"]
+        self.roots = arrays["roots"].astype(np.intp)
+        self.max_depth = int(arrays["max_depth"])
+        self.n_features = int(arrays["n_features"])
+        self.classes = arrays["classes"]
+        # Hash of the exported classifier's pickle, if it was exported from a file
+        self.source_hash = str(arrays["source_hash"]) if "source_hash" in arrays else None
+        self.is_leaf = self.child == np.arange(len(self.child))
+
+    @classmethod
+    def load(cls, path: Path):
+        """Loads a forest saved by save_forest()"""
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Returns the leaf each row ends in for each tree, as a matrix of node indices with one column per tree"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected input with {self.n_features} features, got shape {X.shape}")
+        if np.isnan(X).any():
+            raise ValueError("Input contains NaN")
+        num_trees = len(self.roots)
+        # All pairs start at the roots, so the first level is looked up for whole columns
+        nodes = (self.child[self.roots] + (X[:, self.feature[self.roots]] > self.threshold[self.roots])).ravel()
+        # Offset of each pair's row in the flattened input
+        row_offsets = np.repeat(np.arange(len(X), dtype=np.intp) * self.n_features, num_trees)
+        X = X.ravel()
+        # Pairs that are still descending and their positions in the result, once pairs have been dropped
+        current = nodes
+        positions = None
+        for _ in range(self.max_depth - 1):
+            done = self.is_leaf[current]
+            num_done = np.count_nonzero(done)
+            if num_done == len(current):
+                break
+            if num_done > 0.2 * len(current):
+                remaining = np.flatnonzero(~done)
+                if positions is None:
+                    nodes = current
+                    positions = remaining
+                else:
+                    nodes[positions] = current
+                    positions = positions.take(remaining)
+                current = current.take(remaining)
+                row_offsets = row_offsets.take(remaining)
+            # The right child follows the left one
+            current = self.child.take(current) + (X.take(row_offsets + self.feature.take(current))
+                                                  > self.threshold.take(current))
+        if positions is None:
+            nodes = current
+        else:
+            nodes[positions] = current
+        return nodes.reshape(-1, num_trees)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Returns the averaged class probabilities of the trees for each row"""
+        leaves = self.apply(X)
+        tree_proba = self.value.take(leaves, axis=0)
+        proba = np.zeros((len(leaves), len(self.classes)), dtype=np.float64)
+        for tree in range(leaves.shape[1]):
+            proba += tree_proba[:, tree]
+        proba /= leaves.shape[1]
+        return proba
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Returns the predicted class of each row"""
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def classifier_hash(path: Path) -> str:
+    """Hash of a pickled classifier, stored with its export to detect exports of an older classifier"""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def save_forest(classifier, path: Path, source: Path = None):
+    """
+    Exports a classifier and saves the arrays to a compressed .npz file.
+    :param classifier: fitted RandomForestClassifier
+    :param path: output file
+    :param source: the classifier's pickle file, whose hash is saved to detect outdated exports
+    """
+    arrays = export_forest(classifier)
+    if source is not None:
+        arrays["source_hash"] = np.array(classifier_hash(source))
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def forest_path(classifier_path: Path) -> Path:
+    """Path of the export of a pickled classifier"""
+    return Path(f"{classifier_path}.npz")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Exports a pickled random forest classifier for inference "
+                                                     "without scikit-learn.")
+    arg_parser.add_argument("classifier", type=Path, help="The pickled classifier, e.g. python_logging_classifier.")
+    arg_parser.add_argument("-o", "--output", type=Path,
+                            help="Specify the output file. By default the classifier's path with .npz appended.")
+    settings = arg_parser.parse_args()
+    if not settings.classifier.is_file():
+        arg_parser.error("Classifier file does not exist.")
+    output = settings.output or forest_path(settings.classifier)
+    save_forest(pickle.load(open(settings.classifier, "rb")), output, settings.classifier)
+    print(f"Exported {settings.classifier} to {output}")
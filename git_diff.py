@@ -0,0 +1,100 @@
+import subprocess
+from pathlib import Path
+
+# Modes of regular files in git trees, leaving out symlinks and submodules
+file_modes = {"100644", "100755"}
+
+
+class GitBlob:
+    """
+    A file's content read from a git repository instead of the working tree.
+    Stands in for the file's path in the file lists, printing as the path.
+    """
+
+    def __init__(self, path: Path, data: bytes):
+        """
+        :param path: path of the file in the working tree, used for output
+        :param data: content of the file in the compared revision
+        """
+        self.path = path
+        self.data = data
+
+    def read(self) -> bytes:
+        """Returns the file's content, like reading the file in binary mode would"""
+        return self.data
+
+    def __str__(self):
+        return str(self.path)
+
+
+def run_git(cwd: Path, args: list) -> bytes:
+    """Runs a git command and returns its output, raises RuntimeError with git's message if it fails"""
+    try:
+        result = subprocess.run(["git", *args], cwd=cwd, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("git is not installed")
+    if result.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def changed_files(path: Path, revisions: str, suffix) -> list:
+    """
+    Lists the files below path that were added or modified between two revisions.
+    :param path: file or directory inside a git repository's working tree
+    :param revisions: "BASE..TARGET" or "BASE...TARGET" as understood by git diff, or only "BASE" to compare it
+    with the staged index
+    :param suffix: file extension of the files to list, or a tuple of file extensions
+    :return: list of (path, object id of the file's blob in TARGET or the index)
+    """
+    cwd, pathspec = (path, ".") if path.is_dir() else (path.parent, path.name)
+    args = ["diff", "--raw", "-z", "--no-abbrev", "--no-renames", "--no-ext-diff", "--relative", "--diff-filter=d"]
+    args += [revisions] if ".." in revisions else ["--cached", revisions]
+    output = run_git(cwd, args + ["--", pathspec])
+    files = []
+    # Each entry is ":old_mode new_mode old_id new_id status" and the path, separated by NUL bytes
+    fields = output.split(b"\0")
+    for header, name in zip(fields[0:-1:2], fields[1::2]):
+        old_mode, new_mode, old_id, new_id, status = header.decode().lstrip(":").split(" ")
+        # Unmerged entries of the index have an object id of only zeros
+        if new_mode not in file_modes or not new_id.strip("0"):
+            continue
+        file = cwd / Path(name.decode(errors="surrogateescape"))
+        if file.name.endswith(suffix):
+            files.append((file, new_id))
+    return files
+
+
+def read_blobs(cwd: Path, files: list) -> list:
+    """
+    Reads the blobs of the files from the repository with a single git cat-file process.
+    :param cwd: directory inside the git repository
+    :param files: list of (path, object id) as returned by changed_files()
+    :return: list of GitBlob
+    """
+    if not files:
+        return []
+    process = subprocess.Popen(["git", "cat-file", "--batch"], cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    blobs = []
+    try:
+        # Request the blobs one at a time, so neither pipe fills up while the other side waits
+        for file, object_id in files:
+            process.stdin.write(object_id.encode() + b"\n")
+            process.stdin.flush()
+            header = process.stdout.readline().split()
+            if len(header) != 3 or header[1] != b"blob":
+                raise RuntimeError(f"git cat-file can't read {file} ({object_id})")
+            blobs.append(GitBlob(file, process.stdout.read(int(header[2]))))
+            # Skip the newline following the content
+            process.stdout.read(1)
+    finally:
+        process.stdin.close()
+        process.wait()
+    return blobs
+
+
+def read_changed_files(path: Path, revisions: str, suffix) -> list:
+    """Returns the files below path changed between the revisions, with their content in the target revision,
+    see changed_files()"""
+    files = changed_files(path, revisions, suffix)
+    return read_blobs(path if path.is_dir() else path.parent, files)
@@ -0,0 +1,304 @@
+import argparse
+import hashlib
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# TensorFlow data types of the checkpoint tensors that are read
+tf_dtypes = {1: np.float32, 2: np.float64, 3: np.int32, 9: np.int64}
+# Magic number ending TensorFlow's checkpoint index files, which are LevelDB tables
+table_magic = 0xdb4775248b80fb57
+
+
+def checkpoint_prefix(language: str) -> Path:
+    """Path prefix of the language's hybrid model checkpoint, as saved by training"""
+    return Path("hybrid_models", f"{language}_logging", "checkp")
+
+
+def export_path(language: str) -> Path:
+    """Path of the NumPy export of the language's hybrid model"""
+    return Path(f"{checkpoint_prefix(language)}.npz")
+
+
+def read_varint(data: bytes, pos: int) -> tuple:
+    """Decodes a protobuf / LevelDB varint and returns it and the position after it"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_proto(data: bytes) -> dict:
+    """Decodes the fields of a protobuf message into lists of their raw values by field number"""
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        tag, pos = read_varint(data, pos)
+        wire_type = tag & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise RuntimeError(f"Unsupported protobuf wire type {wire_type}")
+        fields.setdefault(tag >> 3, []).append(value)
+    return fields
+
+
+def read_block(index: bytes, handle: bytes) -> list:
+    """Returns the (key, value) entries of the table block a block handle points to"""
+    offset, pos = read_varint(handle, 0)
+    size, pos = read_varint(handle, pos)
+    if index[offset + size] != 0:
+        raise RuntimeError("Compressed checkpoint index blocks are not supported")
+    block = index[offset:offset + size]
+    num_restarts = struct.unpack_from("<I", block, size - 4)[0]
+    end = size - 4 * (num_restarts + 1)
+    entries = []
+    key = b""
+    pos = 0
+    while pos < end:
+        shared, pos = read_varint(block, pos)
+        non_shared, pos = read_varint(block, pos)
+        value_length, pos = read_varint(block, pos)
+        key = key[:shared] + block[pos:pos + non_shared]
+        pos += non_shared
+        entries.append((key, block[pos:pos + value_length]))
+        pos += value_length
+    return entries
+
+
+def read_checkpoint(prefix: Path) -> dict:
+    """
+    Reads the numerical tensors of a TensorFlow checkpoint without TensorFlow.
+    The index file is a LevelDB table mapping each tensor's name to its data type, shape and location
+    in the data files.
+    :param prefix: checkpoint path prefix, e.g. hybrid_models/python_logging/checkp
+    :return: dict of the tensors by name
+    """
+    index = Path(f"{prefix}.index").read_bytes()
+    if struct.unpack_from("<Q", index, len(index) - 8)[0] != table_magic:
+        raise RuntimeError(f"{prefix}.index is not a checkpoint index")
+    # The footer holds the handles of the metaindex and index blocks
+    footer = index[len(index) - 48:]
+    pos = read_varint(footer, read_varint(footer, 0)[1])[1]
+    entries = []
+    for _, handle in read_block(index, footer[pos:]):
+        entries.extend(read_block(index, handle))
+    # The entry with the empty key is the header with the number of data files
+    header = read_proto(dict(entries)[b""])
+    num_shards = header.get(1, [1])[0]
+    shards = {}
+    tensors = {}
+    for key, value in entries:
+        if not key:
+            continue
+        entry = read_proto(value)
+        dtype = tf_dtypes.get(entry.get(1, [0])[0])
+        if dtype is None:
+            continue
+        shape = [read_proto(dim).get(1, [0])[0] for dim in read_proto(entry.get(2, [b""])[0]).get(2, [])]
+        shard = entry.get(3, [0])[0]
+        if shard not in shards:
+            shards[shard] = Path(f"{prefix}.data-{shard:05d}-of-{num_shards:05d}").read_bytes()
+        offset = entry.get(4, [0])[0]
+        size = entry.get(5, [0])[0]
+        tensors[key.decode()] = np.frombuffer(shards[shard], dtype=dtype, count=size // np.dtype(dtype).itemsize,
+                                              offset=offset).reshape(shape)
+    return tensors
+
+
+def export_hybrid_model(prefix: Path) -> dict:
+    """
+    Collects the weights of the hybrid model built by notebook_helper.build_hybrid_model() from its checkpoint.
+    The embedding weights are those of the checkpoint, as the embedding layer is trained further than the initial
+    embedding matrix. The layers are told apart by their weights' shapes.
+    :param prefix: checkpoint path prefix
+    :return: dict of arrays, see HybridModel
+    """
+    layers = {}
+    for name, tensor in read_checkpoint(prefix).items():
+        # Model weights are saved as layer_with_weights-<n>/[cell/]<weight>/.ATTRIBUTES/VARIABLE_VALUE
+        parts = name.split("/")
+        if not parts[0].startswith("layer_with_weights-") or parts[-2] != ".ATTRIBUTES":
+            continue
+        layers.setdefault(parts[0], {})[parts[-3]] = tensor
+    arrays = {}
+    for weights in layers.values():
+        if "embeddings" in weights:
+            arrays["embeddings"] = weights["embeddings"]
+        elif "recurrent_kernel" in weights:
+            arrays["lstm_kernel"] = weights["kernel"]
+            arrays["lstm_recurrent_kernel"] = weights["recurrent_kernel"]
+            arrays["lstm_bias"] = weights["bias"]
+        elif weights["kernel"].shape[1] == 1:
+            arrays["output_kernel"] = weights["kernel"]
+            arrays["output_bias"] = weights["bias"]
+        else:
+            arrays["other_kernel"] = weights["kernel"]
+            arrays["other_bias"] = weights["bias"]
+    missing = {"embeddings", "lstm_kernel", "other_kernel", "output_kernel"} - arrays.keys()
+    if missing:
+        raise RuntimeError(f"Checkpoint {prefix} lacks the weights of {', '.join(sorted(missing))}")
+    return {name: np.ascontiguousarray(array, dtype=np.float32) for name, array in arrays.items()}
+
+
+def checkpoint_hash(prefix: Path) -> str:
+    """Hash of a checkpoint's index, which holds a checksum of every tensor, to detect outdated exports"""
+    return hashlib.sha256(Path(f"{prefix}.index").read_bytes()).hexdigest()
+
+
+def save_hybrid_model(prefix: Path, path: Path):
+    """Exports a hybrid model checkpoint and saves the weights to a compressed .npz file"""
+    arrays = export_hybrid_model(prefix)
+    arrays["source_hash"] = np.array(checkpoint_hash(prefix))
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def sigmoid(x: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Logistic function, computed in place if out is given"""
+    out = np.negative(x, out=out)
+    # Large negative inputs overflow to an infinite exponential, which correctly gives 0
+    with np.errstate(over="ignore"):
+        np.exp(out, out=out)
+    out += 1
+    return np.reciprocal(out, out=out)
+
+
+class HybridModel:
+    """
+    The hybrid model evaluated with NumPy instead of TensorFlow.
+    The context sequences pass an embedding and an LSTM layer and the other features a dense layer with ReLU,
+    then the concatenated outputs pass the sigmoid output layer, the same as in build_hybrid_model().
+    Computations are in float32 like Keras, so outputs match within float32 rounding.
+    Two shortcuts keep the LSTM cheap: as every LSTM input is one of the few embeddings, their products with the
+    LSTM's kernel are computed once, and as the contexts are padded at the front, the states along a run of leading
+    zeros are the same for all sequences and only computed once.
+    """
+
+    def __init__(self, arrays):
+        """
+        :param arrays: dict of arrays as returned by export_hybrid_model() or loaded from an exported file
+        """
+        self.units = arrays["lstm_recurrent_kernel"].shape[0]
+        # Reorder the gates from Keras' input, forget, cell, output to input, forget, output, cell,
+        # so the gates with a sigmoid activation are next to each other
+        units = self.units
+        gate_order = np.r_[0:2 * units, 3 * units:4 * units, 2 * units:3 * units]
+        # LSTM kernel product of each embedding
+        self.embedded_kernel = (arrays["embeddings"] @ arrays["lstm_kernel"])[:, gate_order]
+        self.recurrent_kernel = np.ascontiguousarray(arrays["lstm_recurrent_kernel"][:, gate_order])
+        self.lstm_bias = arrays["lstm_bias"][gate_order]
+        self.other_kernel = arrays["other_kernel"]
+        self.other_bias = arrays["other_bias"]
+        self.output_kernel = arrays["output_kernel"]
+        self.output_bias = arrays["output_bias"]
+        # Hash of the exported checkpoint's index, if it was exported with save_hybrid_model()
+        self.source_hash = str(arrays["source_hash"]) if "source_hash" in arrays else None
+        # LSTM states after each step of a sequence of zeros, by sequence length
+        self.padding_states = {}
+
+    @classmethod
+    def load(cls, path: Path):
+        """Loads a model saved by save_hybrid_model()"""
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def lstm_step(self, inputs: np.ndarray, h: np.ndarray, c: np.ndarray):
+        """Advances the hidden and cell states in place by one time step of the inputs"""
+        units = self.units
+        z = self.embedded_kernel[inputs]
+        z += h @ self.recurrent_kernel
+        z += self.lstm_bias
+        gates = sigmoid(z[:, :3 * units], out=z[:, :3 * units])
+        candidates = np.tanh(z[:, 3 * units:], out=z[:, 3 * units:])
+        c *= gates[:, units:2 * units]
+        c += gates[:, :units] * candidates
+        np.multiply(gates[:, 2 * units:], np.tanh(c), out=h)
+
+    def padding_trajectory(self, length: int) -> tuple:
+        """Returns the hidden and cell states after 0 to length steps of zeros"""
+        if length not in self.padding_states:
+            h = np.zeros((length + 1, 1, self.units), dtype=np.float32)
+            c = np.zeros((length + 1, 1, self.units), dtype=np.float32)
+            zeros = np.zeros(1, dtype=np.intp)
+            for step in range(length):
+                h[step + 1] = h[step]
+                c[step + 1] = c[step]
+                self.lstm_step(zeros, h[step + 1], c[step + 1])
+            self.padding_states[length] = (h[:, 0], c[:, 0])
+        return self.padding_states[length]
+
+    def lstm(self, context: np.ndarray) -> np.ndarray:
+        """Returns the LSTM's last hidden state for each context sequence"""
+        num_rows, length = context.shape
+        padding_h, padding_c = self.padding_trajectory(length)
+        # Sort the sequences by their number of leading zeros, so the sequences that have started are a prefix
+        nonzero = context != 0
+        starts = np.where(nonzero.any(axis=1), nonzero.argmax(axis=1), length)
+        order = np.argsort(starts, kind="stable")
+        context = context[order]
+        starts = starts[order]
+        h = np.empty((num_rows, self.units), dtype=np.float32)
+        c = np.empty((num_rows, self.units), dtype=np.float32)
+        started = 0
+        for step in range(length):
+            # Sequences starting at this step continue from the state after their leading zeros
+            now_started = np.searchsorted(starts, step, side="right")
+            h[started:now_started] = padding_h[step]
+            c[started:now_started] = padding_c[step]
+            started = now_started
+            if started:
+                self.lstm_step(context[:started, step], h[:started], c[:started])
+        # Sequences of only zeros
+        h[started:] = padding_h[length]
+        result = np.empty_like(h)
+        result[order] = h
+        return result
+
+    def predict_proba(self, X: dict) -> np.ndarray:
+        """
+        Returns the predicted probability of logging for each block.
+        :param X: dict with the "context" sequences and the "other" features, see FeatureEncoder
+        """
+        context = np.asarray(X["context"], dtype=np.intp)
+        other = np.asarray(X["other"], dtype=np.float32)
+        other_features = np.maximum(other @ self.other_kernel + self.other_bias, 0)
+        features = np.concatenate([self.lstm(context), other_features], axis=1)
+        return sigmoid(features @ self.output_kernel + self.output_bias).ravel()
+
+    def predict(self, X: dict) -> np.ndarray:
+        """Returns the rounded predictions for each block, like the Keras model's rounded outputs"""
+        return np.round(self.predict_proba(X))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Exports the hybrid LSTM model's checkpoint for inference "
+                                                     "without TensorFlow.")
+    arg_parser.add_argument("-l", "--language", type=str, required=True, help="Specify the language.")
+    arg_parser.add_argument("-c", "--checkpoint", type=Path,
+                            help="Specify the checkpoint path prefix. By default the language's model in hybrid_models.")
+    arg_parser.add_argument("-o", "--output", type=Path,
+                            help="Specify the output file. By default the checkpoint's path prefix with .npz appended.")
+    settings = arg_parser.parse_args()
+    prefix = settings.checkpoint or checkpoint_prefix(settings.language)
+    if not Path(f"{prefix}.index").is_file():
+        arg_parser.error(f"Checkpoint {prefix} does not exist.")
+    output = settings.output or Path(f"{prefix}.npz")
+    save_hybrid_model(prefix, output)
+    print(f"Exported {prefix} to {output}")
@@ -0,0 +1,181 @@
+import logging
+import os
+import pickle
+import warnings
+from pathlib import Path
+
+import profiler
+from config import rev_node_dicts, reindex
+
+# Length of the LSTM's context input sequences
+lstm_max_length = 80
+
+
+def num_rows(X) -> int:
+    """Number of blocks of an encoded input, either a matrix or the LSTM's dict of context and other inputs"""
+    return len(X["other"]) if isinstance(X, dict) else len(X)
+
+
+def concat_inputs(inputs: list):
+    """Concatenates the encoded inputs of several files"""
+    import numpy as np
+
+    if len(inputs) == 1:
+        return inputs[0]
+    if isinstance(inputs[0], dict):
+        return {key: np.concatenate([X[key] for X in inputs]) for key in inputs[0]}
+    return np.concatenate(inputs)
+
+
+def model_paths(settings) -> list:
+    """Paths relative to the working directory at which the language's model is looked for, any one of them is enough"""
+    if settings.model == "rnd":
+        from forest import forest_path
+
+        clf_name = f"{settings.language}_logging_classifier"
+        return [forest_path(clf_name), Path(clf_name)]
+    from hybrid_model import checkpoint_prefix, export_path
+
+    return [export_path(settings.language), Path(f"{checkpoint_prefix(settings.language)}.index")]
+
+
+def check_model(settings):
+    """Raises RuntimeError if the language's model isn't found in the working directory"""
+    paths = model_paths(settings)
+    if not any(path.is_file() for path in paths):
+        raise RuntimeError(f"No {'random forest' if settings.model == 'rnd' else 'LSTM'} model for "
+                           f"{settings.language} found in {os.getcwd()}, expected {' or '.join(map(str, paths))}")
+
+
+def load_predictor(settings):
+    """
+    Loads the language's random forest classifier or hybrid LSTM model.
+    :param settings: parsed command line arguments, settings.model selects the model
+    :return: function predicting on a list of encoded inputs (see FeatureEncoder) and returning one prediction per row
+    :raises RuntimeError: if the model isn't found, see check_model()
+    """
+    import numpy as np
+
+    check_model(settings)
+
+    if settings.model == "rnd":
+        from forest import CompiledForest, classifier_hash, forest_path
+
+        clf_name = f"{settings.language}_logging_classifier"
+        # Use the classifier's NumPy export unless it was exported from a different classifier
+        if forest_path(clf_name).is_file():
+            forest = CompiledForest.load(forest_path(clf_name))
+            if not os.path.isfile(clf_name) or forest.source_hash in (None, classifier_hash(clf_name)):
+                def predict(inputs: list):
+                    return forest.predict(concat_inputs(inputs))
+
+                return predict
+            logging.getLogger("Logcheck").warning(f"{forest_path(clf_name)} is outdated, using {clf_name}. "
+                                                  f"Export it again with forest.py for faster recommendations.")
+        classifier = pickle.load(open(clf_name, 'rb'))
+        # Classifiers fitted on a DataFrame check the feature names of their input. The encoded matrix has the
+        # columns of config.reindex, so check them once here and predict on the matrix itself without a DataFrame.
+        if hasattr(classifier, "feature_names_in_"):
+            if list(classifier.feature_names_in_) != reindex[settings.language]:
+                raise RuntimeError(f"The columns of {clf_name} don't match the {settings.language} features")
+            warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+        def predict(inputs: list):
+            return classifier.predict(concat_inputs(inputs))
+    else:
+        from hybrid_model import HybridModel, checkpoint_hash, checkpoint_prefix, export_path
+
+        # Use the model's NumPy export unless it was exported from a different checkpoint
+        if export_path(settings.language).is_file():
+            hybrid_model = HybridModel.load(export_path(settings.language))
+            prefix = checkpoint_prefix(settings.language)
+            if (not os.path.isfile(f"{prefix}.index")
+                    or hybrid_model.source_hash in (None, checkpoint_hash(prefix))):
+                def predict(inputs: list):
+                    return hybrid_model.predict(concat_inputs(inputs))
+
+                return predict
+            logging.getLogger("Logcheck").warning(f"{export_path(settings.language)} is outdated, using {prefix}. "
+                                                  f"Export it again with hybrid_model.py for faster recommendations.")
+
+        import tensorflow_addons as tfa
+        from notebooks.notebook_helper import build_hybrid_model
+
+        # Settings
+        vocab_size = len(rev_node_dicts[settings.language])
+        other_input_num_cols = len(reindex[settings.language])
+        output_dims = 100
+        max_length = lstm_max_length
+        batch_size = 64
+        trainable = True
+        dropout = 0.2
+        num_nodes = 128
+        cmpltn_metrics = [tfa.metrics.F1Score(num_classes=1, threshold=0.5)]
+        # Load embedding matrix
+        embedding_matrix = pickle.load(open(f"{settings.language}_embedding_matrix", 'rb'))
+        # Build and compile model
+        model = build_hybrid_model(vocab_size, output_dims, embedding_matrix, max_length,
+                                   trainable, num_nodes, dropout, other_input_num_cols)
+        model.compile(optimizer='adam', loss='binary_crossentropy', metrics=cmpltn_metrics)
+        # Load weights
+        model_cp_filepath = f"hybrid_models{os.sep}{settings.language}_logging{os.sep}checkp"
+        model.load_weights(model_cp_filepath)
+
+        def predict(inputs: list):
+            # The context input is already padded by FeatureEncoder.encode_contexts()
+            pred = model.predict(concat_inputs(inputs), batch_size=batch_size)
+            return np.round(pred).ravel()
+
+    return predict
+
+
+class InferenceBatcher:
+    """
+    Collects the encoded blocks of many files and predicts them in shared batches,
+    so that the per-call overhead of the model is paid once per batch instead of once per file.
+    Predictions are handed back per file in the order the files were added.
+    Batches are only predicted when they are full or flushed, see service.MicroBatcher for bounded latency.
+    """
+
+    def __init__(self, predict, batch_size: int = 4096):
+        """
+        :param predict: function predicting on a list of encoded inputs, see load_predictor()
+        :param batch_size: number of rows at which a batch is predicted
+        """
+        self.predict = predict
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_rows = 0
+
+    def add(self, key, X) -> list:
+        """
+        Adds the encoded blocks of a file.
+        :param key: identifies the file in the returned results
+        :param X: encoded input with one row per block
+        :return: list of (key, predictions) for all files of the batch if a batch was predicted, else an empty list
+        """
+        self.pending.append((key, X))
+        self.pending_rows += num_rows(X)
+        if self.pending_rows >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> list:
+        """Predicts all pending rows and returns (key, predictions) for each pending file"""
+        if not self.pending:
+            return []
+        pending = self.pending
+        # Reset before predicting, so a failed prediction doesn't leave the rows pending
+        self.pending = []
+        self.pending_rows = 0
+        with profiler.stage("predict"):
+            predictions = self.predict([X for key, X in pending])
+        profiler.count("batches")
+        profiler.count("predicted_blocks", len(predictions))
+        results = []
+        start = 0
+        # Scatter the predictions back to their files
+        for key, X in pending:
+            results.append((key, predictions[start:start + num_rows(X)]))
+            start += num_rows(X)
+        return results
@@ -1,21 +1,21 @@
 from tree_sitter import Language, Tree, Node
 
-from extractor import Extractor
+from extractor import Extractor, ParameterVector
 
 
 class JavaExtractor(Extractor):
-    def __init__(self, src: str, lang: Language, tree: Tree, file, settings):
+    def __init__(self, src: bytes, lang: Language, tree: Tree, file, settings):
         super().__init__(src, lang, tree, file, settings)
 
     def get_func_call_str(self, func_call_node: Node):
         assert func_call_node.type == self.names.func_call
-        method_name = func_call_node.child_by_field_name("name").text.decode("UTF-8")
+        method_name = func_call_node.child_by_field_name("name").text.decode("UTF-8", errors="replace")
         calling_object = func_call_node.child_by_field_name("object")
-        calling_object_str = calling_object.text.decode("UTF-8") if calling_object else ""
+        calling_object_str = calling_object.text.decode("UTF-8", errors="replace") if calling_object else ""
         func_call_str = (calling_object_str + ("." if calling_object else "") + method_name).lower()
         return func_call_str
 
-    def check_expression(self, exp_child: Node, param_vec: dict):
+    def check_expression(self, exp_child: Node, param_vec: ParameterVector):
         if exp_child.type == self.names.func_call:
             func_call_str = self.get_func_call_str(exp_child)
             if self.keyword.match(func_call_str):
@@ -39,7 +39,7 @@ class JavaExtractor(Extractor):
             # self.unhandled_node_types.add(exp_child.type)
             self.logger.error(f"check_expression: Unhandled node type: {exp_child.type}")
 
-    def check_block(self, block_node: Node, param_vec: dict, recursion_level=0):
+    def check_block(self, block_node: Node, param_vec: ParameterVector, recursion_level=0):
 
         if recursion_level == 0:
             self.build_context_of_block_node(block_node, param_vec)
@@ -91,7 +91,7 @@ class JavaExtractor(Extractor):
             parent_type = logical_parent.type
         return parent_type
 
-    def check_parent(self, block_node: Node, param_vec: dict):
+    def check_parent(self, block_node: Node, param_vec: ParameterVector):
         """Find the block node's and parent's types.
         Collect information pertaining to the block node's ancestors and siblings"""
 
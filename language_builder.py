@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from tree_sitter import Language
+
+# Directory holding one shared library, build manifest and lock file per language
+build_dir = Path(Path(__file__).parent / "build").resolve()
+# File extensions of grammar sources that end up in the shared library
+grammar_source_suffixes = [".c", ".cc", ".h"]
+# Languages already loaded by this process
+loaded_languages = {}
+
+
+class BuildLock:
+    """Exclusive file lock serializing grammar builds across processes, e.g. pool workers or parallel CI jobs"""
+
+    def __init__(self, lock_path: Path):
+        self.lock_path = lock_path
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_path, "a+")
+        if os.name == "nt":
+            import msvcrt
+            self.lock_file.seek(0)
+            # Retries for about 10 seconds before raising, so keep trying until the other build is done
+            while True:
+                try:
+                    msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        else:
+            import fcntl
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if os.name == "nt":
+            import msvcrt
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+def grammar_path(language: str) -> Path:
+    return Path(Path(__file__).parent / ("tree-sitter-" + language)).resolve()
+
+
+def grammar_sources(language: str) -> list:
+    """Returns the sorted list of source files of the language's grammar"""
+    src_path = grammar_path(language) / "src"
+    if not src_path.is_dir():
+        raise RuntimeError(f"Grammar sources for {language} not found in {src_path}")
+    return sorted(path for path in src_path.rglob("*") if path.suffix in grammar_source_suffixes)
+
+
+def source_stats(sources: list) -> dict:
+    """Size and modification time of each source file, used to skip hashing unchanged grammars"""
+    stats = {}
+    for path in sources:
+        stat = path.stat()
+        stats[str(path)] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def source_hash(sources: list) -> str:
+    """Content hash over the names and contents of the grammar's source files"""
+    sha = hashlib.sha256()
+    for path in sources:
+        sha.update(path.name.encode("utf8"))
+        sha.update(path.read_bytes())
+    return sha.hexdigest()
+
+
+def read_manifest(manifest_path: Path) -> dict:
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(manifest_path: Path, digest: str, stats: dict):
+    """Writes the manifest to a temporary file moved into place atomically, must be called holding the BuildLock"""
+    tmp_manifest_path = manifest_path.with_name(f"{manifest_path.stem}.{os.getpid()}.json")
+    with open(tmp_manifest_path, "w") as f:
+        json.dump({"hash": digest, "stats": stats}, f)
+    os.replace(tmp_manifest_path, manifest_path)
+
+
+def is_up_to_date(lib_path: Path, manifest: dict, stats: dict) -> bool:
+    """Checks the manifest against the sizes and mtimes of the grammar sources, without hashing them"""
+    return lib_path.is_file() and bool(manifest) and manifest.get("stats") == stats
+
+
+def build_language(language: str) -> Path:
+    """
+    Builds the shared library for a single language in the 'build' directory.
+    The library is only rebuilt if the grammar sources changed since the last build, as recorded in the manifest.
+    If only their mtimes changed, the manifest is updated, so that the sources aren't hashed again.
+    Concurrent builds of the same language are serialized with a file lock and the new library is moved into place
+    atomically, so processes loading the library never see a partially written file.
+    :param language: string containing the programming language to be analyzed
+    :return: path of the language's shared library
+    """
+    build_dir.mkdir(parents=True, exist_ok=True)
+    lib_path = build_dir / f"{language}.so"
+    manifest_path = build_dir / f"{language}.json"
+    sources = grammar_sources(language)
+    stats = source_stats(sources)
+    if is_up_to_date(lib_path, read_manifest(manifest_path), stats):
+        return lib_path
+    with BuildLock(build_dir / f"{language}.lock"):
+        # Another process may have finished the build while we were waiting for the lock
+        manifest = read_manifest(manifest_path)
+        if is_up_to_date(lib_path, manifest, stats):
+            return lib_path
+        digest = source_hash(sources)
+        if lib_path.is_file() and manifest.get("hash") == digest:
+            # Only the mtimes changed, e.g. after a checkout, so record them to skip hashing the next time
+            write_manifest(manifest_path, digest, stats)
+            return lib_path
+        tmp_lib_path = build_dir / f"{language}.{os.getpid()}.so"
+        Language.build_library(str(tmp_lib_path), [str(grammar_path(language))])
+        os.replace(tmp_lib_path, lib_path)
+        write_manifest(manifest_path, digest, stats)
+    return lib_path
+
+
+def create_ts_lang_obj(language: str) -> Language:
+    """
+    Returns the tree-sitter language object, building the language's library in the 'build' directory if needed.
+    Only the requested language is built and loaded, and each language is loaded at most once per process.
+    :param language: string containing the programming language to be analyzed
+    :return: tree-sitter language object
+    """
+    if language not in loaded_languages:
+        loaded_languages[language] = Language(str(build_language(language)), language)
+    return loaded_languages[language]
@@ -1,20 +1,51 @@
 import argparse
+import csv
 import importlib
+import json
 import logging
+import mmap
 import multiprocessing as mp
+import os
 import pickle
 import sys
+import time
+from copy import copy
+from functools import partial
 from pathlib import Path
 from string import ascii_letters
 
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from tqdm import tqdm
-from tree_sitter import Language, Parser
+from tree_sitter import Parser
 
 from config import supported_languages, suf, rev_suf
 from config import parameter_vectors, rev_node_dicts, reindex
-from notebooks.notebook_helper import get_X_and_y_from_csv
+from feature_cache import FeatureCache, evict
+from feature_encoder import FeatureEncoder
+from file_walker import FileWalker
+from git_diff import GitBlob, read_changed_files
+from inference import load_predictor, InferenceBatcher, lstm_max_length
+from language_builder import create_ts_lang_obj
+from parquet_writer import ParquetFeatureWriter
+import profiler
+from scheduler import chunk_in_order, schedule
+from watcher import create_watcher, reparse
+from worker_pool import WorkerPool, in_order, run_in_process, resource
+
+logger = logging.getLogger("Logcheck")
+# Files of at least this many bytes are memory-mapped instead of read
+mmap_threshold = 2 ** 20
+# Files skipped in this run for exceeding a limit or failing, as (file, reason)
+skipped_files = []
+
+
+def import_extractor(language: str):
+    """ Returns the extractor class of a language """
+    if language == "python":
+        from python_extractor import PythonExtractor as LangExtractor
+    elif language == "java":
+        from java_extractor import JavaExtractor as LangExtractor
+    else:
+        raise RuntimeError(f"{language} is not actually supported yet.")
+    return LangExtractor
 
 
 def overwrite():
@@ -28,90 +59,254 @@ def overwrite():
         overwrite()
 
 
-def create_ts_lang_obj(language: str) -> Language:
-    """
-    Creates a tree-sitter language library in the 'build' directory
-    A given language library only needs to be built once across many executions.
-    :param language: string containing the programming language to be analyzed
-    :return: tree-sitter language object
-    """
-    lib_path = str(Path(Path(__file__).parent / "build/my-languages.so").resolve())
-    lang_paths = [str(Path(Path(__file__).parent / ("tree-sitter-" + lang)).resolve()) for lang in supported_languages]
-    Language.build_library(lib_path, lang_paths)
-    ts_lang = Language(lib_path, language)
-    return ts_lang
+# Per-process extraction state, filled once by init_worker() so that tasks only need to ship a file path
+worker_state = {}
 
 
-def extract_file(file, settings, LangExtractor, train_mode):
-    """ Extracts features from a source code file and returns them as a list of parameter vectors (also lists) """
+def language_state(settings, LangExtractor) -> dict:
+    """ Builds the tree-sitter language, parser and extractor configuration of settings.language """
+    tree_lang = create_ts_lang_obj(settings.language)
+    parser = Parser()
+    parser.set_language(tree_lang)
+    return {
+        "settings": settings,
+        "LangExtractor": LangExtractor,
+        "tree_lang": tree_lang,
+        "parser": parser,
+        "encoder": FeatureEncoder(settings.language),
+        "cache": FeatureCache(settings.cache_dir, settings, LangExtractor) if settings.cache_dir else None,
+    }
 
-    # Read the source code
+
+def init_worker(settings, LangExtractor, train_mode, languages: dict = None):
+    """
+    Builds the tree-sitter language, parser and extractor configuration once per process.
+    Used as the initializer of the worker pool and called directly for in-process extraction.
+    :param settings: parsed command line arguments
+    :param LangExtractor: the language's extractor class
+    :param train_mode: whether parameter vectors of blocks that already contain logging are kept
+    :param languages: for files of several languages, (settings, extractor class) of each language by language,
+    instead of settings and LangExtractor. The process switches to a file's language for it, see select_language().
+    """
+    if languages is None:
+        languages = {settings.language: (settings, LangExtractor)}
+    worker_state["languages"] = {language: language_state(*languages[language]) for language in languages}
+    worker_state.update(next(iter(worker_state["languages"].values())))
+    worker_state["train_mode"] = train_mode
+    # Pool workers start their own profile, whose parts they hand back to the parent with each file's result
+    if settings.profile and mp.parent_process() is not None:
+        profiler.current = profiler.Profile()
+
+
+def file_language(file, language: str = None) -> str:
+    """ Returns the language of a source code file, or GitBlob: the given language, or else the one of its extension """
+    if language is not None:
+        return language
+    path = file.path if isinstance(file, GitBlob) else Path(file)
+    return rev_suf[path.suffix]
+
+
+def select_language(file):
+    """ Switches the process' extraction configuration to the language of the file if it works on several languages """
+    if len(worker_state["languages"]) > 1:
+        worker_state.update(worker_state["languages"][file_language(file)])
+
+
+def timed_task(task, file):
+    """ Runs a task on a file and records the file's time in the process' profile """
+    start = time.perf_counter()
+    result = task(file)
+    profile = profiler.current
+    profile.add_file(str(file), time.perf_counter() - start, profile.counters.get("bytes", 0),
+                     profile.counters.get("blocks", 0))
+    return result
+
+
+def file_task(task, settings):
+    """ Returns the task to run on each file, which records the file's time if profiling """
+    return partial(timed_task, task) if settings.profile else task
+
+
+def create_pool(settings, LangExtractor, train_mode: bool, workers: int = None, languages: dict = None) -> WorkerPool:
+    """ Starts the worker processes, each setting up its parser once, so that only the file paths are sent to them.
+    The files that are skipped are collected in skipped_files. See init_worker() for the arguments. """
+    max_memory = int(settings.max_memory * 2 ** 20) if settings.max_memory is not None else None
+    workers = workers or settings.workers
+    # Hold the results of about a chunk per worker while the output is written, so memory use doesn't grow
+    # with the corpus when writing is slower than extracting
+    return WorkerPool(workers, init_worker, (settings, LangExtractor, train_mode, languages), skipped_files,
+                      settings.file_timeout, max_memory, workers * settings.chunksize)
+
+
+def read_file(file, memory_map: bool = True):
+    """ Reads a source code file, or a GitBlob read from a repository, and returns its source code as bytes,
+    or None if it can't be read. The source code isn't decoded, tree-sitter parses the bytes as they are.
+    Large files are memory-mapped unless memory_map is False, so they aren't copied into the process.
+    Memory maps must not be kept after the file may have changed. """
     try:
-        with open(file) as f:
-            sourcecode = f.read()
-            f.close()
-    except UnicodeDecodeError as e:
-        logger.error(f"Encountered UnicodeDecodeError in file {file}:\n{e}")
-        return []
+        if isinstance(file, GitBlob):
+            return file.read()
+        with open(file, "rb") as f:
+            if memory_map and os.fstat(f.fileno()).st_size >= mmap_threshold:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return f.read()
     except IsADirectoryError as e:
         logger.error(f"Encountered directory with a name ending like the language extension {file}:\n{e}")
-        return []
-    # Create Tree-Sitter language object and parser.
-    # These could be reused for another source code file, but this is nontrivial due to parallelization.
-    tree_lang = create_ts_lang_obj(settings.language)
-    parser = Parser()
-    parser.set_language(tree_lang)
-    # Create abstract syntax tree
-    tree = parser.parse(bytes(sourcecode, "utf8"))
+        return None
+
+
+def count_nodes(tree, limit: int) -> int:
+    """ Counts the nodes of a syntax tree, stopping as soon as there are more than limit """
+    cursor = tree.walk()
+    count = 1
+    while count <= limit:
+        if cursor.goto_first_child() or cursor.goto_next_sibling():
+            count += 1
+            continue
+        # Climb up to the next ancestor with a following sibling
+        while cursor.goto_parent():
+            if cursor.goto_next_sibling():
+                count += 1
+                break
+        else:
+            break
+    return count
+
+
+def parse_file(file, src=None):
+    """ Reads and parses a source code file with the process' parser and returns the language's extractor for it """
+
+    # Read the source code
+    if src is None:
+        src = read_file(file)
+        if src is None:
+            return None
+    # Create abstract syntax tree, which keeps a reference to the source code instead of a copy
+    with profiler.stage("parse"):
+        tree = worker_state["parser"].parse(src)
+    max_nodes = worker_state["settings"].max_nodes
+    if max_nodes is not None and count_nodes(tree, max_nodes) > max_nodes:
+        raise RuntimeError(f"The syntax tree has more than {max_nodes} nodes")
     # Instantiate the language's extractor
-    extractor = LangExtractor(sourcecode, tree_lang, tree, file, settings)
+    return worker_state["LangExtractor"](src, worker_state["tree_lang"], tree, file, worker_state["settings"])
+
+
+def get_param_vecs(file, training: bool):
+    """ Returns the parameter vectors of a file, from the feature cache if the file's content is cached.
+    Returns None if the file can't be read. """
+
+    select_language(file)
+    with profiler.stage("read"):
+        src = read_file(file)
+    if src is None:
+        return None
+    profiler.count("files")
+    profiler.count("bytes", len(src))
+    cache = worker_state["cache"]
+    if cache is not None:
+        with profiler.stage("cache"):
+            key = cache.key(src, training)
+            file_param_vecs = cache.get(key)
+        if file_param_vecs is not None:
+            profiler.count("cache_hits")
+            profiler.count("blocks", len(file_param_vecs))
+            return file_param_vecs
+    extractor = parse_file(file, src)
+    with profiler.stage("extract"):
+        file_param_vecs = extractor.fill_param_vectors(training=training)
+    profiler.count("blocks", len(file_param_vecs))
+    if cache is not None:
+        with profiler.stage("cache"):
+            cache.put(key, file_param_vecs)
+    return file_param_vecs
+
+
+def extract_file(file):
+    """ Extracts features from a source code file and returns them as a list of parameter vectors """
+
     # Start the extraction
-    file_param_vecs = extractor.fill_param_vectors(training=train_mode)
-    if settings.debug:
+    file_param_vecs = get_param_vecs(file, worker_state["train_mode"])
+    if file_param_vecs is None:
+        return []
+    if worker_state["settings"].debug:
         file_param_vecs = ["/" + str(file) + "y"] + file_param_vecs
     return file_param_vecs
 
 
 def extract(files, settings, LangExtractor, output, train_mode: bool = True):
-    """ Starts parallelized feature extraction and writes the result to output """
+    """ Starts parallelized feature extraction and writes the result to output.
+    Rows are written as soon as their file has been extracted, so memory use doesn't grow with the corpus. """
 
     # Extract features from each file by calling extract_file() in parallel
-    pool = mp.Pool(mp.cpu_count())
-    # Async variant:
-    # param_vectors = pool.starmap_async(extract_file, [(file, settings, train_mode) for file in files]).get()
-    # Ordered parallelization:
-    param_vectors = pool.starmap(extract_file, [(file, settings, LangExtractor, train_mode) for file in files])
-    param_vectors = [par_vec for par_vec_list in param_vectors for par_vec in par_vec_list]
-    pool.close()
-    # Write output
-    header = list(parameter_vectors[settings.language].keys())
-    output.write(",".join(header) + "\n")
-    output.write("\n".join(
-        [str(x).replace(" ", "").replace("'", "")[1:-1] for x in param_vectors]))
-    output.write("\n")
+    pool = create_pool(settings, LangExtractor, train_mode)
+    try:
+        # In order of completion if requested, scheduling the largest files first so no worker is left with a large
+        # file at the end. Ordered parallelization otherwise, which starts on the first files while the folder is being
+        # searched.
+        task = file_task(extract_file, settings)
+        if settings.unordered:
+            results = pool.run(task, schedule(list(files), settings.workers))
+        else:
+            results = in_order(pool.run(task, chunk_in_order(files, settings.chunksize)))
+        # Skipped files have no result
+        file_param_vec_lists = (result for index, file, result in results if result is not None)
+        # Write output
+        if settings.format == "parquet":
+            writer = ParquetFeatureWriter(output, settings.language)
+            for file_param_vecs in file_param_vec_lists:
+                with profiler.stage("write"):
+                    for par_vec in file_param_vecs:
+                        # Skip the file path markers of debug mode
+                        if type(par_vec) != str:
+                            writer.write_row(par_vec)
+            with profiler.stage("write"):
+                writer.close()
+        else:
+            writer = csv.writer(output, lineterminator="\n")
+            writer.writerow(parameter_vectors[settings.language].keys())
+            for file_param_vecs in file_param_vec_lists:
+                with profiler.stage("write"):
+                    for par_vec in file_param_vecs:
+                        # Debug mode marks the start of a file's parameter vectors with the file path,
+                        # written without spaces and quotes like the rows used to be
+                        if type(par_vec) == str:
+                            output.write(par_vec.replace(" ", "").replace("'", "")[1:-1] + "\n")
+                        else:
+                            writer.writerow(par_vec)
+    finally:
+        pool.close()
+
 
 def train(files, settings, LangExtractor, output):
     """Train classifier"""
 
     # Import modules only needed for training
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
     from sklearn.model_selection import train_test_split
     from sklearn.metrics import recall_score, f1_score, precision_score, balanced_accuracy_score
+    from forest import save_forest, forest_path
+    from notebooks.notebook_helper import get_X_and_y_from_csv
 
     model_is_rndfrst = (settings.model == "rnd")
 
-    # Extract features from each file by calling extract_file() in parallel
-    pool = mp.Pool(mp.cpu_count())
-    # Ordered parallelization:
-    param_vectors = pool.starmap(extract_file, [(file, settings, LangExtractor, True) for file in files])
-    param_vectors = [par_vec for par_vec_list in param_vectors for par_vec in par_vec_list]
-    pool.close()
-
-    # Get X and y and drop context for random forest classifiers as they don't use it
-    X, y = get_X_and_y_from_csv(param_vectors, drop_context=model_is_rndfrst)
-
-    # Reindex
-    X = X.reindex((["context"] if not model_is_rndfrst else []) + reindex[settings.language],
-                  fill_value=0, axis="columns")
+    # Extract features from each file by calling extract_file() in parallel, the largest files first,
+    # which needs all files, so the folder is searched before the workers start
+    pool = create_pool(settings, LangExtractor, True)
+    try:
+        results = pool.run(file_task(extract_file, settings), schedule(list(files), settings.workers))
+        # Keep the order of the files
+        param_vectors = sorted(((index, result) for index, file, result in results if result is not None),
+                               key=lambda item: item[0])
+    finally:
+        pool.close()
+    param_vectors = [par_vec.values() for index, par_vec_list in param_vectors for par_vec in par_vec_list]
+    with profiler.stage("prepare"):
+        df = pd.DataFrame(param_vectors, columns=parameter_vectors[settings.language].keys())
+
+        # Get X encoded in the columns of the models and y, and drop context for random forest classifiers
+        # as they don't use it
+        X, y = get_X_and_y_from_csv(df, drop_context=model_is_rndfrst, encoder=FeatureEncoder(settings.language))
 
     # Convert the compacted context from letters into strings of integers
     if not model_is_rndfrst:
@@ -127,7 +322,8 @@ def train(files, settings, LangExtractor, output):
                                             min_samples_split=5,
                                             class_weight={False: 1, True: 4}
                                             )
-        classifier.fit(X_train, y_train)
+        with profiler.stage("fit"):
+            classifier.fit(X_train, y_train)
         y_pred = classifier.predict(X_test)
     else:
         # from notebooks.notebook_helper import MyCorpus, build_embedding_matrix, build_callbacks, build_hybrid_model
@@ -245,9 +441,12 @@ def train(files, settings, LangExtractor, output):
             if output.is_file() and not settings.force:
                 overwrite()
             output = open(output, 'wb')
-        # Save classifier
-        pickle.dump(classifier, output)
-        print(f"Created and saved classifier in {output}")
+        # Save classifier, and its export for recommendations without scikit-learn
+        with profiler.stage("write"):
+            pickle.dump(classifier, output)
+            output.close()
+            save_forest(classifier, forest_path(output.name), Path(output.name))
+        print(f"Created and saved classifier in {output.name} and {forest_path(output.name)}")
     else:
         print(f"LSTM checkpoint file path: {model_cp_filepath}")
 
@@ -255,107 +454,203 @@ def train(files, settings, LangExtractor, output):
     #     print("output == sys.stdout")
 
 
-def recommend(files, settings, LangExtractor, output):
-    """ Recommend logging """
+def encode_file(file):
+    """ Extracts and encodes the features of a file for recommendation. Runs in the worker processes.
+    Returns the file, the type and location of each block and the encoded features (None if there are no blocks) """
 
-    model_is_rndfrst = (settings.model == "rnd")
+    # Build a list of parameter vectors for all interesting nodes in the current file
+    file_param_vecs = get_param_vecs(file, training=False)
+    if not file_param_vecs:
+        return file, [], None
+    blocks = [(par_vec["type"], par_vec["location"]) for par_vec in file_param_vecs]
+    with profiler.stage("encode"):
+        X = encode_param_vecs(file_param_vecs)
+    return file, blocks, X
+
+
+def encode_param_vecs(param_vecs: list):
+    """ Encodes parameter vectors into the input of the process' model """
+    # Encode the parameter vectors into the model's input
+    X = worker_state["encoder"].encode(param_vecs)
+    if worker_state["settings"].model != "rnd":
+        X = {"context": FeatureEncoder.encode_contexts([par_vec["context"] for par_vec in param_vecs],
+                                                       lstm_max_length),
+             "other": X}
+    return X
 
+
+def format_recommendations(file, blocks, file_recommendations) -> list:
+    """ Returns the output lines for the blocks of a file predicted to need logging """
     recommendations = []
     # rev_node_dict = rev_node_dicts[settings.language]
-    if model_is_rndfrst:
-        clf_name = f"{settings.language}_logging_classifier"
-        classifier: RandomForestClassifier = pickle.load(open(clf_name, 'rb'))
+    # Write the yes-instances as recommendations to the output file
+    if 1 in file_recommendations:
+        recommendations.append(f"File: {file}")
+        for i, prediction in enumerate(file_recommendations):
+            if prediction:
+                block_type, location = blocks[i]
+                line = location.split("-")[0].split(";")[0]
+                recommendations.append(f"We recommend logging in the "
+                                       # f"{rev_node_dict[block_type]}"
+                                       f"{block_type}"
+                                       f" starting in line {line}")
+    return recommendations
+
+
+def recommend(files, settings, LangExtractor, output, languages: dict = None):
+    """ Recommend logging.
+    Files are extracted and encoded in parallel by the worker pool, the largest files first, while this process
+    holds the model and predicts on the encoded files in batches spanning many files as they finish.
+    The recommendations are written in the order of the file list.
+    For files of several languages, languages holds (settings, extractor class) of each language by language,
+    the same workers extract the files of all languages and each language's model is loaded once. """
+
+    # Scheduling the files by size needs all of them, so the folder is searched before the workers start
+    files = list(files)
+    # Only set up the languages of the files
+    if languages is not None:
+        found = {file_language(file) for file in files}
+        languages = {language: languages[language] for language in languages if language in found}
+        language_settings = {language: lang_settings for language, (lang_settings, _) in languages.items()}
     else:
-        # Settings
-        vocab_size = len(rev_node_dicts[settings.language])
-        other_input_num_cols = len(reindex[settings.language])
-        output_dims = 100
-        max_length = 80
-        batch_size = 64
-        trainable = True
-        dropout = 0.2
-        num_nodes = 128
-        cmpltn_metrics = [tfa.metrics.F1Score(num_classes=1, threshold=0.5)]
-        # Load embedding matrix
-        embedding_matrix = pickle.load(open(f"{settings.language}_embedding_matrix", 'rb'))
-        # Build and compile model
-        model = build_hybrid_model(vocab_size, output_dims, embedding_matrix, max_length,
-                                   trainable, num_nodes, dropout, other_input_num_cols)
-        model.compile(optimizer='adam', loss='binary_crossentropy', metrics=cmpltn_metrics)
-        # Load weights
-        model_cp_filepath = f"hybrid_models{os.sep}{settings.language}_logging{os.sep}checkp"
-        model.load_weights(model_cp_filepath)
+        language_settings = {settings.language: settings}
+    # Start extracting before loading the models, so the workers don't inherit them
+    if len(files) > 1:
+        pool = create_pool(settings, LangExtractor, False, min(settings.workers, len(files)), languages)
+        # Parallelization in order of completion, with a progress bar
+        from tqdm import tqdm
+        chunks = schedule(files, settings.workers)
+        encoded_files = tqdm(pool.run(file_task(encode_file, settings), chunks), total=len(files))
+    # A single file is handled in this process to avoid the pool's startup cost
+    else:
+        pool = None
+        if files:
+            init_worker(settings, LangExtractor, False, languages)
+        encoded_files = run_in_process(file_task(encode_file, settings), files, skipped_files)
 
-    for file in tqdm(files):
-        with open(file) as f:
-            sourcecode = f.read()
-            f.close()
-        # print(f"File: {file}")
-        # Create tree-sitter parser
-        tree_lang = create_ts_lang_obj(settings.language)
-        parser = Parser()
-        parser.set_language(tree_lang)
-        # Create abstract syntax tree
-        tree = parser.parse(bytes(sourcecode, "utf8"))
-        # Instantiate the language's extractor
-        extractor = LangExtractor(sourcecode, tree_lang, tree, file, settings)
-        # Build a list of parameter vectors for all interesting nodes in the current file
-        file_param_vecs = extractor.fill_param_vectors(training=False)
-        # print(df.to_string())
-        if file_param_vecs:
-            # Build Pandas DataFrame from the list of parameter vectors
-            df = pd.DataFrame.from_dict(file_param_vecs)
-            # logger.debug(df); exit()
-
-            # Drop unused features
-            cols_to_drop = [
-                "contains_logging", "location", "grandparent",
-                "num_siblings", "depth_from_def", "depth_from_root"
-            ]
-            if model_is_rndfrst:
-                cols_to_drop.append("context")
-            X = df.drop(cols_to_drop, axis=1)
-
-            # One-hot encode the parameters type and parent
-            X = pd.get_dummies(X, columns=["type", "parent"])
-            # Reindex the dataframe to ensure all possible type and parent values are present as columns
-            X = X.reindex((["context"] if not model_is_rndfrst else []) + reindex[settings.language],
-                          fill_value=0, axis="columns")
-            if not model_is_rndfrst:
-                # Convert the compacted context from letters into strings of integers
-                X.context = [list(map(lambda c: str(ascii_letters.index(c)), list(str(x)))) for x in X.context]
-
-                # Prepare test sets
-                padded_inputs = pad_sequences(np.array(list(X.context), dtype=object),
-                                                      maxlen=max_length, value=0.0)
-                regular_inputs = X.drop(["context"], axis=1)
-                X_dict = {"context": padded_inputs, "other": regular_inputs}
-
-
-
-                # Predict
-                pred = model.predict(X_dict, batch_size=batch_size)
-                file_recommendations = np.round(pred)
+    try:
+        # Predict in batches across files, with a batcher per language whose model is loaded with its first file
+        batchers = {}
+        # Recommendations of each file by its index in the file list
+        file_lines = {}
+        for index, file, result in encoded_files:
+            # Skip files without blocks and skipped files
+            if result is None or result[2] is None:
+                continue
+            file, blocks, X = result
+            language = file_language(file, settings.language)
+            if language not in batchers:
+                with profiler.stage("load_model"):
+                    batchers[language] = InferenceBatcher(load_predictor(language_settings[language]),
+                                                          settings.batch_size)
+            for (batch_index, batch_file, batch_blocks), file_recommendations in batchers[language].add(
+                    (index, file, blocks), X):
+                file_lines[batch_index] = format_recommendations(batch_file, batch_blocks, file_recommendations)
+        for batcher in batchers.values():
+            for (batch_index, batch_file, batch_blocks), file_recommendations in batcher.flush():
+                file_lines[batch_index] = format_recommendations(batch_file, batch_blocks, file_recommendations)
+        recommendations = [line for index in sorted(file_lines) for line in file_lines[index]]
+    finally:
+        if pool is not None:
+            pool.close()
+    with profiler.stage("write"):
+        if recommendations:
+            output.write("\n".join(recommendations))
+        else:
+            output.write("No recommendations")
+        output.write("\n")
+        output.close()
+
+
+def watch(files, settings, LangExtractor, output, walker: FileWalker = None):
+    """ Recommend logging, then keep watching the files and update the recommendations of files as they change.
+    The trees of all files are kept, so changed files are parsed incrementally,
+    and only the blocks of the function definitions that changed are extracted and predicted again.
+    The changed files reported while watching a folder are filtered like the folder's files with the walker. """
+
+    init_worker(settings, LangExtractor, False)
+    parser = worker_state["parser"]
+    predict = load_predictor(settings)
+    location_index = list(parameter_vectors[settings.language]).index("location")
+
+    def prediction_key(par_vec) -> tuple:
+        """The features of a block apart from its location, which determine its prediction"""
+        row = par_vec.values()
+        return tuple(row[:location_index]) + tuple(row[location_index + 1:])
+    # Source code, tree, extraction results and predictions of each file
+    states = {}
+
+    def update(changed_files, initial: bool) -> list:
+        """Extracts and predicts the changed files and returns the lines of their recommendations"""
+        updated = []
+        for file in changed_files:
+            # The source code is kept for comparing it with the next version, so it isn't memory-mapped
+            try:
+                src = read_file(file, memory_map=False) if file.is_file() else None
+            except FileNotFoundError:
+                src = None
+            # Forget deleted files
+            if src is None:
+                states.pop(file, None)
+                continue
+            state = states.get(file)
+            if state is None:
+                tree = parser.parse(src)
+                previous = {}
+                predictions = {}
+            elif state["src"] == src:
+                continue
             else:
-                file_recommendations = classifier.predict(X)
-
-            df['predictions'] = file_recommendations
-            # Write the yes-instances as recommendations to the output file
-            if 1 in file_recommendations:
-                recommendations.append(f"File: {file}")
-                for i, prediction in enumerate(file_recommendations):
-                    if prediction:
-                        line = file_param_vecs[i]['location'].split("-")[0].split(";")[0]
-                        recommendations.append(f"We recommend logging in the "
-                                               # f"{rev_node_dict[file_param_vecs[i]['type']]}"
-                                               f"{file_param_vecs[i]['type']}"
-                                               f" starting in line {line}")
-    if recommendations:
-        output.write("\n".join(recommendations))
-    else:
-        output.write("No recommendations")
+                tree = reparse(parser, state["tree"], state["src"], src)
+                previous = state["results"]
+                predictions = state["predictions"]
+            extractor = LangExtractor(src, worker_state["tree_lang"], tree, file, settings)
+            file_param_vecs, results = extractor.fill_param_vectors_incremental(False, previous)
+            keys = [prediction_key(par_vec) for par_vec in file_param_vecs]
+            predictions = {key: predictions[key] for key in keys if key in predictions}
+            states[file] = {"src": src, "tree": tree, "results": results, "predictions": predictions}
+            updated.append((file, file_param_vecs, keys, predictions))
+        # Predict only the blocks whose features haven't been predicted before, all files at once
+        new_param_vecs = {}
+        for file, file_param_vecs, keys, predictions in updated:
+            for par_vec, key in zip(file_param_vecs, keys):
+                if key not in predictions:
+                    new_param_vecs[key] = par_vec
+        if new_param_vecs:
+            new_predictions = dict(zip(new_param_vecs, predict([encode_param_vecs(list(new_param_vecs.values()))])))
+            for file, file_param_vecs, keys, predictions in updated:
+                for key in keys:
+                    if key not in predictions:
+                        predictions[key] = new_predictions[key]
+        lines = []
+        for file, file_param_vecs, keys, predictions in updated:
+            blocks = [(par_vec["type"], par_vec["location"]) for par_vec in file_param_vecs]
+            file_recommendations = [predictions[key] for key in keys]
+            file_lines = format_recommendations(file, blocks, file_recommendations)
+            if not file_lines and not initial:
+                file_lines = [f"File: {file}", "No recommendations"]
+            lines.extend(file_lines)
+        return lines
+
+    watcher = create_watcher(settings.path, suf[settings.language], settings.poll_interval, walker)
+    recommendations = update(files, initial=True)
+    output.write("\n".join(recommendations) if recommendations else "No recommendations")
     output.write("\n")
-    output.close()
+    output.flush()
+    try:
+        while True:
+            changed = watcher.wait()
+            if walker is not None:
+                changed = [file for file in changed if walker.accepts(file)]
+            recommendations = update(sorted(changed), initial=False)
+            if recommendations:
+                output.write("\n".join(recommendations) + "\n")
+                output.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        output.close()
 
 
 # DEPRECATED
@@ -392,9 +687,9 @@ def analyze():
 if __name__ == "__main__":
     # Handle arguments
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument("path", type=Path,
+    arg_parser.add_argument("path", type=Path, nargs="?",
                             help="The file or folder containing files to predict or train on. "
-                                 "Files in subdirectories are included.")
+                                 "Files in subdirectories are included. Not used with --serve.")
     arg_parser.add_argument("-m", "--model", type=str, choices=["rnd", "lstm"],
                             help="Specify the classifier model, either random forest (rnd) or LSTM (lstm). "
                                  "Required for prediction and training.")
@@ -418,15 +713,130 @@ if __name__ == "__main__":
                                  "Can't be used together with -a context extraction.")
     arg_parser.add_argument("-c", "--encode", action="store_true",
                             help="ASCII encode type names to save space.")
+    arg_parser.add_argument("--format", type=str, choices=["csv", "parquet"],
+                            help="Output format of extraction mode. Parquet stores the features in compressed, typed "
+                                 "columns and requires pyarrow and an output file. "
+                                 "By default the format is chosen by the output file's suffix, otherwise csv.")
+    arg_parser.add_argument("-j", "--workers", type=int, default=mp.cpu_count(),
+                            help="Number of worker processes extracting the files. By default one per CPU.")
+    arg_parser.add_argument("--chunksize", type=int, default=8,
+                            help="Number of files sent to a worker at once during ordered extraction. Otherwise "
+                                 "the files are scheduled by size, in chunks that get smaller towards the end.")
+    arg_parser.add_argument("--unordered", action="store_true",
+                            help="Write extracted features in the order the files finish instead of the file order, "
+                                 "extracting the largest files first.")
+    arg_parser.add_argument("--batch-size", type=int, default=4096,
+                            help="Number of blocks, collected across files, that are predicted together.")
+    arg_parser.add_argument("--max-latency", type=float, default=None,
+                            help="Service mode: seconds to wait for further requests before predicting a batch "
+                                 "that isn't full.")
+    arg_parser.add_argument("--engine", type=str, choices=["query", "dfs"], default="query",
+                            help="Feature extraction engine. 'dfs' finds all blocks and their ancestors in a single "
+                                 "depth-first walk per file instead of climbing the tree for each block. "
+                                 "Both produce identical features.")
+    arg_parser.add_argument("--cache-dir", type=Path,
+                            help="Directory of a feature cache. Files whose content, language and settings have been "
+                                 "extracted before are not parsed again.")
+    arg_parser.add_argument("--cache-size", type=int, default=1024,
+                            help="Maximum size of the feature cache in MB. "
+                                 "The least recently used entries are removed after each run.")
+    arg_parser.add_argument("--diff", type=str, metavar="REVISIONS",
+                            help="Only work on the files changed between two git revisions given as BASE..TARGET "
+                                 "(or BASE...TARGET to compare with their merge base), or between BASE and the staged "
+                                 "index if only BASE is given. The files are read from the repository, so TARGET "
+                                 "doesn't need to be checked out.")
+    arg_parser.add_argument("--watch", action="store_true",
+                            help="Keep running after the recommendations and update them whenever files change. "
+                                 "Changed files are parsed incrementally and only changed functions are extracted again.")
+    arg_parser.add_argument("--poll-interval", type=float, default=0.5,
+                            help="Seconds between checks for changed files in watch mode "
+                                 "where inotify isn't available.")
+    arg_parser.add_argument("--serve", type=str, metavar="ADDRESS",
+                            help="Run as a service on a Unix socket path or localhost port that keeps the models loaded "
+                                 "and recommends logging for the files or source code sent to it. "
+                                 "See logcheck_client.py for a client.")
+    arg_parser.add_argument("--include", type=str, action="append", metavar="PATTERN",
+                            help="Only work on the files below the folder matching this pattern, or inside folders "
+                                 "matching it, in the format of .gitignore files. Can be given several times.")
+    arg_parser.add_argument("--exclude", type=str, action="append", metavar="PATTERN",
+                            help="Skip the files and folders below the folder matching this pattern, in the format "
+                                 "of .gitignore files. Can be given several times.")
+    arg_parser.add_argument("--no-ignore", action="store_true",
+                            help="Also work on files ignored by .gitignore files and in dependency folders "
+                                 "(node_modules, __pycache__ and virtual environments).")
+    arg_parser.add_argument("--max-file-size", type=float, metavar="MB",
+                            help="Skip files larger than this many MB.")
+    arg_parser.add_argument("--file-timeout", type=float, metavar="SECONDS",
+                            help="Skip files a worker spends more than this many seconds on, including parsing. "
+                                 "The worker process is replaced.")
+    arg_parser.add_argument("--max-nodes", type=int, metavar="N",
+                            help="Skip files whose syntax tree has more than this many nodes.")
+    arg_parser.add_argument("--max-memory", type=float, metavar="MB",
+                            help="Limit the address space of each worker process to this many MB. "
+                                 "Files that exceed it are skipped, a worker that crashes is replaced.")
+    arg_parser.add_argument("--skipped-report", type=Path, metavar="REPORT",
+                            help="Write the files that were skipped for exceeding a limit or failing, "
+                                 "and why, to a JSON report.")
+    arg_parser.add_argument("--profile", type=Path, metavar="REPORT",
+                            help="Time the stages of the run and count files, bytes, nodes, blocks and queries "
+                                 "in all processes, and write them with the slowest files to a JSON report.")
+    arg_parser.add_argument("--profile-slowest", type=int, default=10, metavar="N",
+                            help="Number of slowest files in the profile report.")
     settings = arg_parser.parse_args()
 
+    # Run as a service
+    if settings.serve:
+        if settings.extract or settings.train or settings.watch:
+            arg_parser.error("Service mode is only available for recommendation.")
+        if settings.profile:
+            arg_parser.error("Profiling isn't available in service mode.")
+        if not settings.model:
+            arg_parser.error("Service mode requires specification of model via -m")
+        logging.basicConfig(level=logging.INFO)
+        from logcheck_client import parse_address
+        from service import check_models, remove_stale_socket, serve
+        try:
+            kind, where = parse_address(settings.serve)
+            check_models(settings)
+            if kind == "unix":
+                remove_stale_socket(where)
+        except (ValueError, RuntimeError) as e:
+            arg_parser.error(str(e))
+        serve(settings)
+        sys.exit()
+
     # Check arguments
+    if settings.path is None:
+        arg_parser.error("The path of a file or folder is required.")
     if not settings.path.exists():
         arg_parser.error("Path does not exist.")
     if settings.alt and settings.all:
         arg_parser.error("Can't build context while also extracting features for all blocks.")
     if settings.extract and settings.train:
         arg_parser.error("Can't enter extraction mode and training mode at the same time.")
+    if settings.watch and (settings.extract or settings.train or settings.alt):
+        arg_parser.error("Watch mode is only available for recommendation.")
+    if settings.diff and (settings.watch or settings.alt):
+        arg_parser.error("Can't restrict watch mode or analysis to changed files.")
+    if settings.profile and (settings.watch or settings.alt):
+        arg_parser.error("Profiling is only available for extraction, training and recommendation.")
+    if settings.max_latency is not None:
+        arg_parser.error("The maximum latency only applies to service mode.")
+    if settings.workers < 1:
+        arg_parser.error("At least one worker process is required.")
+    if settings.cache_size < 0:
+        arg_parser.error("The cache size can't be negative.")
+    if settings.max_file_size is not None and settings.max_file_size <= 0:
+        arg_parser.error("The maximum file size must be positive.")
+    if settings.file_timeout is not None and settings.file_timeout <= 0:
+        arg_parser.error("The file timeout must be positive.")
+    if settings.max_nodes is not None and settings.max_nodes < 1:
+        arg_parser.error("The maximum number of nodes must be positive.")
+    if settings.max_memory is not None:
+        if settings.max_memory <= 0:
+            arg_parser.error("The memory limit must be positive.")
+        if resource is None:
+            arg_parser.error("Memory limits are only available on Unix.")
     if (not settings.extract or settings.train) and not settings.model:
         arg_parser.error("Prediction and training mode require specification of model via -m")
     # Detect batch mode
@@ -437,10 +847,8 @@ if __name__ == "__main__":
     else:
         arg_parser.error("Path is neither file nor directory.")
 
-    # Import modules for classifier training and recommendation
-    if settings.model == "rnd":
-        pass
-    elif settings.model == "lstm":
+    # Import modules for training the neural network, recommendation imports its model's modules when loading it
+    if settings.model == "lstm" and settings.train:
         import gensim.models
         from notebooks.notebook_helper import MyCorpus, build_embedding_matrix, build_callbacks, build_hybrid_model
         import tensorflow_addons as tfa
@@ -468,41 +876,75 @@ if __name__ == "__main__":
     #             settings.output = Path("analysis/" + settings.path.name + ".txt")
     #             print(f"No output file specified. Using: {settings.output}")
 
+    # Choose the extraction output format
+    if not settings.format:
+        settings.format = "parquet" if settings.output and settings.output.suffix == ".parquet" else "csv"
+    if settings.format == "parquet":
+        if not settings.extract:
+            arg_parser.error("Parquet output is only available in extraction mode.")
+        if not settings.output:
+            arg_parser.error("Parquet output requires an output file.")
+        try:
+            import pyarrow
+        except ImportError:
+            arg_parser.error("Parquet output requires pyarrow.")
+
     # File overwrite dialog
     if settings.output and settings.output.is_file() and not settings.force:
         overwrite()
     # Catch permission errors before program execution
     try:
-        writing = "wb" if settings.train else "w"
+        writing = "wb" if settings.train or settings.format == "parquet" else "w"
         out = open(settings.output, writing) if settings.output else sys.stdout
     except PermissionError as e:
         arg_parser.error(e)
-    # Ensure language is known
+    # Ensure language is known. Recommendation for a folder without a language works on the files of all languages,
+    # detecting the language of each file by its extension.
     if batch:
-        if settings.language is None:
-            arg_parser.error("Batch option requires specification of language.")
+        if settings.language is None and (settings.extract or settings.train or settings.watch or settings.alt):
+            arg_parser.error("Batch option requires specification of language, "
+                             "except for recommendation, which detects the language of each file.")
     # Without batch mode, determine language if not specified
     elif settings.language is None:
         try:
             settings.language = rev_suf[settings.path.suffix]
         except KeyError:
             arg_parser.error(f"Supported languages: {supported_languages}")
-    # Determine files to work on
+    # Determine files to work on. The files of a folder are found while they are being worked on.
+    walker = None
+    suffix = suf[settings.language] if settings.language else tuple(suf.values())
     if batch:
-        files = list(settings.path.glob(f"**/*{suf[settings.language]}"))
+        max_size = int(settings.max_file_size * 2 ** 20) if settings.max_file_size is not None else None
+        walker = FileWalker(settings.path, suffix, settings.include, settings.exclude, not settings.no_ignore, max_size)
+    if settings.diff:
+        try:
+            files = read_changed_files(settings.path, settings.diff, suffix)
+        except RuntimeError as e:
+            arg_parser.error(str(e))
+        if walker is not None:
+            files = [file for file in files if walker.accepts(file.path, len(file.data))]
+    elif batch:
+        files = walker
     else:
         files = [settings.path]
     # Initialize logger
     logging.basicConfig(level=logging.DEBUG)
-    logger = logging.getLogger("Logcheck")
     # Import the language's config and extractor
     # The extractor class has to be passed on as an argument due to parallelization
-    if settings.language == "python":
-        from python_extractor import PythonExtractor as LangExtractor
-    elif settings.language == "java":
-        from java_extractor import JavaExtractor as LangExtractor
+    languages = None
+    if settings.language is not None:
+        LangExtractor = import_extractor(settings.language)
+    # Without a language, each language's settings and extractor
     else:
-        raise RuntimeError(f"{settings.language} is not actually supported yet.")
+        LangExtractor = None
+        languages = {}
+        for language in suf:
+            lang_settings = copy(settings)
+            lang_settings.language = language
+            languages[language] = (lang_settings, import_extractor(language))
+    if settings.profile:
+        profiler.current = profiler.Profile(settings.profile_slowest)
+    start = time.perf_counter()
     # Branch into extraction or recommendation
     if settings.extract:
         extract(files, settings, LangExtractor, out)
@@ -511,5 +953,24 @@ if __name__ == "__main__":
     else:
         if settings.alt:
             analyze()
+        elif settings.watch:
+            watch(files, settings, LangExtractor, out, walker)
         else:
-            recommend(files, settings, LangExtractor, out)
+            recommend(files, settings, LangExtractor, out, languages)
+    # Keep the feature cache within its size limit
+    if settings.cache_dir:
+        evict(settings.cache_dir, settings.cache_size * 2 ** 20)
+    if settings.profile:
+        mode = "extract" if settings.extract else "train" if settings.train else "recommend"
+        profiler.current.write(settings.profile, time.perf_counter() - start, mode=mode,
+                               language=settings.language or sorted(suf), model=settings.model,
+                               workers=settings.workers, engine=settings.engine, chunksize=settings.chunksize,
+                               batch_size=settings.batch_size)
+    # Report the files that were skipped
+    skipped = (walker.skipped if walker is not None else []) + skipped_files
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} files")
+    if settings.skipped_report:
+        with open(settings.skipped_report, "w") as f:
+            json.dump([{"file": str(file), "reason": reason} for file, reason in skipped], f, indent=2)
+            f.write("\n")
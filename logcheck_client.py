@@ -0,0 +1,73 @@
+import argparse
+import json
+import socket
+import sys
+from pathlib import Path
+
+from config import supported_languages
+
+# Client of the recommendation service (logcheck.py --serve). Only uses the standard library,
+# so it starts quickly enough for pre-commit hooks and editor integrations.
+
+
+def parse_address(address: str):
+    """
+    Returns ("tcp", (host, port)) for a port number or host:port, where only localhost is allowed,
+    and ("unix", path) for anything else.
+    """
+    if address.isdigit():
+        return "tcp", ("127.0.0.1", int(address))
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        if host not in ["localhost", "127.0.0.1", "::1"]:
+            raise ValueError("The service only listens on localhost")
+        return "tcp", (host, int(port))
+    return "unix", address
+
+
+def connect(address: str) -> socket.socket:
+    kind, where = parse_address(address)
+    if kind == "tcp":
+        return socket.create_connection(where)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(where)
+    return client
+
+
+def request_recommendations(address: str, requests: list) -> list:
+    """
+    Sends requests to a running service and returns its responses.
+    :param address: the service's Unix socket path or localhost port
+    :param requests: list of request dicts, see service.RecommendationService.recommend()
+    """
+    with connect(address) as client:
+        stream = client.makefile("rwb")
+        responses = []
+        for request in requests:
+            stream.write(json.dumps(request).encode("utf8") + b"\n")
+        stream.flush()
+        for _ in requests:
+            responses.append(json.loads(stream.readline()))
+        return responses
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Requests recommendations from a running logcheck service.")
+    arg_parser.add_argument("address", type=str, help="Unix socket path or localhost port of the service.")
+    arg_parser.add_argument("files", type=Path, nargs="+", help="Source code files to recommend logging for.")
+    arg_parser.add_argument("-l", "--language", type=str, choices=supported_languages,
+                            help="Specify the language, by default it is determined by the file suffix.")
+    settings = arg_parser.parse_args()
+    requests = [{"path": str(file.resolve()), "language": settings.language} for file in settings.files]
+    failed = False
+    lines = []
+    for response in request_recommendations(settings.address, requests):
+        if "error" in response:
+            print(response["error"], file=sys.stderr)
+            failed = True
+        lines.extend(response["lines"] if "lines" in response else [])
+    if lines:
+        print("\n".join(lines))
+    elif not failed:
+        print("No recommendations")
+    sys.exit(1 if failed else 0)
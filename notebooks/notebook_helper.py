@@ -2,20 +2,9 @@
 
 import os
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import StratifiedShuffleSplit
-from sklearn.metrics import roc_auc_score, balanced_accuracy_score
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import precision_score, recall_score, f1_score
-
 import pandas as pd
-# Tensorflow + Keras
-from keras.layers import CuDNNLSTM
-import tensorflow as tf
-import tensorflow.keras as keras
-from tensorflow.keras.layers import Dense, LSTM, Embedding, Bidirectional
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
+# Scikit-learn, Tensorflow and Keras are imported by the functions using them,
+# so that importing the helpers for the data preparation stays fast
 
 from numpy import zeros
 import numpy as np
@@ -83,23 +72,13 @@ def get_X_and_y_from_csv(
         drop_depth_from_def=True,
         drop_depth_from_root=True,
         drop_context=True,
+        encoder=None,
 ):
-    if type(filepath) == list:
-        df = pd.DataFrame.from_dict(filepath)
-    elif str(filepath).endswith(".csv"):
-        df = pd.read_csv(filepath)
-    else:
-        df = pd.read_csv(filepath + ".csv")
-    # remove errors
-    df = df[df.parent != "b"]
-    df = df[df.type != "b"]
-    df = df[df.parent != "ERROR"]
-    df = df[df.type != "ERROR"]
-    columns_to_onehot_encode = [
-        "type",
-        "parent"
-    ]
-    df = pd.get_dummies(df, columns=columns_to_onehot_encode)
+    """
+    Loads extracted parameter vectors and returns the features X and the labels y.
+    If a FeatureEncoder is given, X is encoded in the encoder's columns (plus the context if it isn't dropped)
+    and the other drop options have no effect.
+    """
     columns_to_drop = [
         "location",
         "contains_logging",
@@ -122,6 +101,43 @@ def get_X_and_y_from_csv(
     if drop_context:
         columns_to_drop.append("context")
 
+    columns_to_onehot_encode = [
+        "type",
+        "parent"
+    ]
+    if type(filepath) == list:
+        df = pd.DataFrame.from_dict(filepath)
+    elif isinstance(filepath, pd.DataFrame):
+        df = filepath
+    elif str(filepath).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        # Only load the columns that are used
+        columns = [column for column in pq.read_schema(filepath).names
+                   if column not in columns_to_drop or column == "contains_logging"]
+        df = pq.read_table(filepath, columns=columns).to_pandas()
+        columns_to_drop = ["contains_logging"]
+    elif str(filepath).endswith(".csv"):
+        df = pd.read_csv(filepath)
+    else:
+        df = pd.read_csv(filepath + ".csv")
+    # remove errors
+    df = df[df.parent != "b"]
+    df = df[df.type != "b"]
+    df = df[df.parent != "ERROR"]
+    df = df[df.type != "ERROR"]
+    if encoder is not None:
+        X = pd.DataFrame(encoder.encode_frame(df), columns=encoder.columns, index=df.index)
+        if not drop_context:
+            X.insert(0, "context", df.context)
+        return X, df.contains_logging
+    # Dictionary encoded Parquet columns are loaded as categoricals.
+    # Only one-hot encode the categories that occur, in the same order as for csv files.
+    for column in columns_to_onehot_encode:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            categories = df[column].cat.remove_unused_categories()
+            df[column] = categories.cat.reorder_categories(sorted(categories.cat.categories))
+    df = pd.get_dummies(df, columns=columns_to_onehot_encode)
+
     X = df.drop(columns_to_drop, axis=1)
     y = df.contains_logging
     return X, y
@@ -139,6 +155,12 @@ def compute_scores_and_cm(
         max_depth=None,
         pos_class_weight=4
 ):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import StratifiedShuffleSplit
+    from sklearn.metrics import roc_auc_score, balanced_accuracy_score
+    from sklearn.metrics import confusion_matrix
+    from sklearn.metrics import precision_score, recall_score, f1_score
+
     class_weight = {False: 1, True: pos_class_weight}
     # class_weight = "balanced"
 
@@ -229,6 +251,9 @@ def show_stats(df: pd.DataFrame):
 def build_others_model(vocab_size, output_dims, embedding_matrix, max_length,
                        trainable, num_nodes, dropout, other_input_num_cols):
     """Build a tensorflow model using only the other features as input"""
+    import tensorflow.keras as keras
+    from tensorflow.keras.layers import Dense
+    from tensorflow.keras.models import Sequential
 
     model = Sequential()
     model.add(keras.Input(shape=(other_input_num_cols,)))
@@ -241,6 +266,7 @@ def build_others_model(vocab_size, output_dims, embedding_matrix, max_length,
 def build_hybrid_model(vocab_size, output_dims, embedding_matrix, max_length,
                        trainable, num_nodes, dropout, other_input_num_cols):
     """Build a tensorflow model using both the context and the other features as inputs"""
+    import tensorflow.keras as keras
 
     context_input = keras.Input(shape=(max_length,), name="context")
     other_input = keras.Input(shape=(other_input_num_cols,), name="other")
@@ -275,6 +301,11 @@ def build_hybrid_model(vocab_size, output_dims, embedding_matrix, max_length,
 
 def build_model(name, vocab_size, output_dims, embedding_matrix, max_length, trainable, num_nodes, dropout,
                 return_sequences=True):
+    from keras.layers import CuDNNLSTM
+    import tensorflow as tf
+    from tensorflow.keras.layers import Dense, Embedding, Bidirectional
+    from tensorflow.keras.models import Sequential
+
     model = Sequential()
     model.add(
         Embedding(vocab_size, output_dims, weights=[embedding_matrix], input_length=max_length, trainable=trainable))
@@ -312,6 +343,8 @@ def build_model(name, vocab_size, output_dims, embedding_matrix, max_length, tra
 
 
 def build_callbacks(callback, callback_monitor, repo_name, run_folder, kfold=0, old=False):
+    from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
+
     callbacks = []
     if "es" in callback:
         es = EarlyStopping(monitor=callback_monitor,
@@ -0,0 +1,64 @@
+from config import parameter_vectors
+
+# Categorical features stored dictionary encoded
+categorical_features = ["type", "parent", "grandparent"]
+
+
+def feature_schema(language: str):
+    """Returns the Parquet schema of the language's parameter vectors"""
+    import pyarrow as pa
+
+    fields = []
+    for feature, default in parameter_vectors[language].items():
+        if feature in categorical_features:
+            fields.append(pa.field(feature, pa.dictionary(pa.int16(), pa.string())))
+        elif type(default) == str:
+            fields.append(pa.field(feature, pa.string()))
+        else:
+            fields.append(pa.field(feature, pa.int32()))
+    return pa.schema(fields)
+
+
+class ParquetFeatureWriter:
+    """
+    Writes parameter vectors to a compressed, columnar Parquet file.
+    Rows are buffered per column and appended to the file one row group at a time.
+    """
+
+    def __init__(self, output, language: str, row_group_size: int = 65536, compression: str = "zstd"):
+        """
+        :param output: path or binary file object to write to
+        :param language: language of the parameter vectors
+        :param row_group_size: number of rows buffered before they are written as a row group
+        :param compression: Parquet compression codec
+        """
+        import pyarrow.parquet as pq
+
+        self.schema = feature_schema(language)
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(output, self.schema, compression=compression)
+        self.columns = [[] for _ in self.schema.names]
+        self.num_rows = 0
+
+    def write_row(self, par_vec):
+        """Adds a parameter vector given as a list of feature values in the order of the schema"""
+        for column, value in zip(self.columns, par_vec):
+            column.append(value)
+        self.num_rows += 1
+        if self.num_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows as a row group"""
+        import pyarrow as pa
+
+        if not self.num_rows:
+            return
+        arrays = [pa.array(column, type=field.type) for column, field in zip(self.columns, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = [[] for _ in self.schema.names]
+        self.num_rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,122 @@
+import heapq
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Profile:
+    """
+    Per-stage timers and counters of a run, enabled with --profile.
+    Every process records into its own profile. Pool workers hand the part recorded for a file back together with
+    the file's result (see take()), and the parent merges these parts into its own profile.
+    The stage times are summed over all processes, so with several workers they can exceed the wall time.
+    Workers of a WorkerPool also record the time they spend on chunks of files, for their utilization.
+    Code records into the profile of its process with the module's stage() and count().
+    """
+
+    def __init__(self, slowest: int = 10):
+        """
+        :param slowest: number of slowest files to keep
+        """
+        self.seconds = {}
+        self.counters = {}
+        self.slowest = slowest
+        # Min-heap of (seconds, file, bytes, blocks) of the slowest files
+        self.files = []
+        # Seconds spent on chunks, number of chunks and number of files by process id
+        self.workers = {}
+
+    def add_time(self, stage: str, seconds: float):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def count(self, counter: str, number: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + number
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Times the enclosed code as part of the stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_file(self, file: str, seconds: float, num_bytes: int, blocks: int):
+        """Records a file's processing time, keeping only the slowest files"""
+        self.add_file_entry((seconds, file, num_bytes, blocks))
+
+    def add_file_entry(self, entry: tuple):
+        if len(self.files) < self.slowest:
+            heapq.heappush(self.files, entry)
+        elif self.files and entry > self.files[0]:
+            heapq.heapreplace(self.files, entry)
+
+    def add_worker(self, pid: int, seconds: float, files: int):
+        """Records a chunk of files a process has worked on"""
+        worker = self.workers.setdefault(pid, [0.0, 0, 0])
+        worker[0] += seconds
+        worker[1] += 1
+        worker[2] += files
+
+    def take(self) -> dict:
+        """Returns what has been recorded since the last call and resets the profile, for merging in the parent"""
+        recorded = {"seconds": self.seconds, "counters": self.counters, "files": self.files, "workers": self.workers}
+        self.seconds = {}
+        self.counters = {}
+        self.files = []
+        self.workers = {}
+        return recorded
+
+    def merge(self, recorded: dict):
+        """Adds what another process recorded, see take()"""
+        for stage, seconds in recorded["seconds"].items():
+            self.add_time(stage, seconds)
+        for counter, number in recorded["counters"].items():
+            self.count(counter, number)
+        for entry in recorded["files"]:
+            self.add_file_entry(tuple(entry))
+        for pid, (seconds, chunks, files) in recorded["workers"].items():
+            worker = self.workers.setdefault(pid, [0.0, 0, 0])
+            worker[0] += seconds
+            worker[1] += chunks
+            worker[2] += files
+
+    def report(self, wall_seconds: float, **details) -> dict:
+        """
+        Returns the profile as a JSON serializable report.
+        :param wall_seconds: wall time of the run
+        :param details: further information about the run to include
+        """
+        return {
+            **details,
+            "wall_seconds": wall_seconds,
+            "stage_seconds": dict(sorted(self.seconds.items(), key=lambda item: -item[1])),
+            "counters": dict(sorted(self.counters.items())),
+            "slowest_files": [{"file": file, "seconds": seconds, "bytes": num_bytes, "blocks": blocks}
+                              for seconds, file, num_bytes, blocks in sorted(self.files, reverse=True)],
+            # Share of the wall time each process spent working on chunks
+            "worker_utilization": [{"pid": pid, "busy_seconds": seconds, "chunks": chunks, "files": files,
+                                    "utilization": seconds / wall_seconds if wall_seconds > 0 else None}
+                                   for pid, (seconds, chunks, files) in sorted(self.workers.items())],
+        }
+
+    def write(self, path, wall_seconds: float, **details):
+        """Writes the report to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.report(wall_seconds, **details), f, indent=2)
+            f.write("\n")
+
+
+# Profile of this process, None unless profiling
+current = None
+
+
+def stage(name: str):
+    """Times the enclosed code as part of the stage if this process is profiling"""
+    return current.stage(name) if current is not None else nullcontext()
+
+
+def count(counter: str, number: int = 1):
+    """Adds to the counter if this process is profiling"""
+    if current is not None:
+        current.count(counter, number)
@@ -1,12 +1,12 @@
 from tree_sitter import Language, Tree, Node
 
-from extractor import Extractor
+from extractor import Extractor, ParameterVector
 
 extra_debugging = False
 
 
 class PythonExtractor(Extractor):
-    def __init__(self, src: str, lang: Language, tree: Tree, file, settings):
+    def __init__(self, src: bytes, lang: Language, tree: Tree, file, settings):
         """
         :param src: Source code to extract paramaeter vectors from
         :param lang: Treesitter language object
@@ -17,10 +17,10 @@ class PythonExtractor(Extractor):
 
     def get_func_call_str(self, func_call_node: Node):
         assert func_call_node.type == self.names.func_call
-        func_call_str = func_call_node.child_by_field_name("function").text.decode("UTF-8").lower()
+        func_call_str = func_call_node.child_by_field_name("function").text.decode("UTF-8", errors="replace").lower()
         return func_call_str
 
-    def check_expression(self, exp_child: Node, param_vec: dict):
+    def check_expression(self, exp_child: Node, param_vec: ParameterVector):
         """Checks an expression node for contained features of the parent block node"""
 
         # Call
@@ -57,7 +57,7 @@ class PythonExtractor(Extractor):
         elif exp_child.type == "yield":
             param_vec["contains_yield"] += 1
 
-    def check_block(self, block_node: Node, param_vec: dict):
+    def check_block(self, block_node: Node, param_vec: ParameterVector):
         """Checks a block node for contained features, including logging by calling check_expression().
         Optionally also build the node's context."""
 
@@ -100,7 +100,7 @@ class PythonExtractor(Extractor):
             #         self.debug_helper(child)
             #         raise RuntimeError("Child of block not in contains")
 
-    def check_parent(self, block_node: Node, param_vec: dict):
+    def check_parent(self, block_node: Node, param_vec: ParameterVector):
         """Find the block node's and parent's types.
         Collect information pertaining to the block node's ancestors and siblings"""
 
@@ -0,0 +1,64 @@
+import os
+
+from git_diff import GitBlob
+
+# Cost of a file on top of its size in bytes, for opening, parsing and sending it regardless of its size
+file_overhead = 4096
+# Chunks of small files cost at least this much, so their tasks aren't dominated by sending them to the workers
+min_chunk_cost = 2 ** 16
+
+
+def file_cost(file) -> int:
+    """Estimates the cost of extracting a file, or a GitBlob, from its size in bytes"""
+    try:
+        size = len(file.data) if isinstance(file, GitBlob) else os.stat(file).st_size
+    except OSError:
+        # The task reports files that can't be read
+        size = 0
+    return size + file_overhead
+
+
+def schedule(files: list, workers: int) -> list:
+    """
+    Divides the files into chunks for a worker pool, so that no worker is left with a large file at the end
+    while the others are idle. The files are ordered by their estimated cost, the largest first, and chunks are
+    formed with guided self-scheduling: each chunk takes about a 4 * workers-th part of the remaining cost,
+    so large files are sent on their own and the long tail of small files in chunks that get smaller towards
+    the end, though never below min_chunk_cost.
+    :param files: the files, or GitBlobs
+    :param workers: number of worker processes
+    :return: list of chunks, each a list of (index in files, file)
+    """
+    costs = [file_cost(file) for file in files]
+    order = sorted(range(len(files)), key=lambda index: -costs[index])
+    remaining = sum(costs)
+    chunks = []
+    chunk, chunk_cost = [], 0
+    target = max(remaining / (4 * workers), min_chunk_cost)
+    for index in order:
+        chunk.append((index, files[index]))
+        chunk_cost += costs[index]
+        if chunk_cost >= target:
+            chunks.append(chunk)
+            remaining -= chunk_cost
+            chunk, chunk_cost = [], 0
+            target = max(remaining / (4 * workers), min_chunk_cost)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def chunk_in_order(files, size: int):
+    """
+    Divides the files into chunks of size files in their order, taking the files from the iterable
+    only as the chunks are needed.
+    :return: generator of lists of (index in files, file)
+    """
+    chunk = []
+    for index, file in enumerate(files):
+        chunk.append((index, file))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
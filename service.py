@@ -0,0 +1,297 @@
+import asyncio
+import importlib
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+from copy import copy
+from pathlib import Path
+
+from config import suf, rev_suf
+from logcheck_client import parse_address
+
+
+def remove_stale_socket(path: str):
+    """
+    Removes the Unix socket a previous service left behind at path, so the service can listen there again.
+    Raises RuntimeError if something other than a socket is at path or a service is still listening on it.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError(f"{path} exists and isn't a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(path)
+        except ConnectionRefusedError:
+            pass
+        else:
+            raise RuntimeError(f"A service is already listening on {path}")
+    os.unlink(path)
+
+
+class MicroBatcher:
+    """
+    Coalesces the prediction requests of concurrent clients into shared batches.
+    After the first request of a batch arrives, further requests are collected for up to max_latency seconds
+    or until batch_size blocks are pending, then the whole batch is predicted at once in a worker thread.
+    """
+
+    def __init__(self, predict, batch_size: int = 4096, max_latency: float = 0.005):
+        """
+        :param predict: function predicting on a list of encoded inputs, see inference.load_predictor()
+        :param batch_size: number of blocks at which a batch is predicted without waiting any longer
+        :param max_latency: seconds to wait for further requests after the first one of a batch
+        """
+        from inference import InferenceBatcher
+
+        # Batches are flushed explicitly, so the batcher's own batch size is never reached
+        self.batcher = InferenceBatcher(predict, batch_size=float("inf"))
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    async def predict(self, X):
+        """Predicts the encoded blocks of a file together with those of other pending requests"""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((future, X))
+        return await future
+
+    async def run(self):
+        from inference import num_rows
+
+        loop = asyncio.get_running_loop()
+        while True:
+            future, X = await self.queue.get()
+            self.batcher.add(future, X)
+            rows = num_rows(X)
+            deadline = loop.time() + self.max_latency
+            while rows < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    future, X = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self.batcher.add(future, X)
+                rows += num_rows(X)
+            pending = [future for future, X in self.batcher.pending]
+            try:
+                results = await loop.run_in_executor(None, self.batcher.flush)
+            except Exception as e:
+                for future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for future, predictions in results:
+                if not future.done():
+                    future.set_result(predictions)
+
+
+class RecommendationService:
+    """
+    Recommends logging for the files or source code sent by clients.
+    The models are loaded once per language on first use, in a worker thread so that the requests of languages
+    already loaded are answered meanwhile, and kept for the lifetime of the service.
+    Source code is parsed and extracted in worker threads, each with its own parsers,
+    and the blocks of concurrent requests are predicted in shared batches.
+    """
+
+    def __init__(self, settings):
+        """
+        :param settings: parsed command line arguments, settings.model selects the models
+        """
+        self.settings = settings
+        # Per language settings, extractor class, encoder and batcher
+        self.languages = {}
+        # Futures of the languages being loaded
+        self.loading = {}
+        self.thread_state = threading.local()
+
+    def load_language(self, language: str) -> dict:
+        """Loads the language's model and extraction configuration. Runs in a worker thread."""
+        from feature_encoder import FeatureEncoder
+        from inference import load_predictor
+
+        settings = copy(self.settings)
+        settings.language = language
+        LangExtractor = getattr(importlib.import_module(language + "_extractor"), language.capitalize() + "Extractor")
+        return {
+            "settings": settings,
+            "LangExtractor": LangExtractor,
+            "encoder": FeatureEncoder(language),
+            "predict": load_predictor(settings),
+        }
+
+    async def language_state(self, language: str) -> dict:
+        """Returns the language's model and extraction configuration, loading them once on first use.
+        Concurrent requests of a language wait for the same load, a failed load is tried again with the next request."""
+        if language not in self.languages:
+            loading = self.loading.get(language)
+            if loading is None:
+                loading = self.loading[language] = asyncio.get_running_loop().run_in_executor(
+                    None, self.load_language, language)
+            try:
+                state = await loading
+            finally:
+                self.loading.pop(language, None)
+            # The first of the waiting requests sets up the batcher
+            if language not in self.languages:
+                max_latency = self.settings.max_latency if self.settings.max_latency is not None else 0.005
+                state["batcher"] = MicroBatcher(state.pop("predict"), self.settings.batch_size, max_latency)
+                self.languages[language] = state
+        return self.languages[language]
+
+    def parser(self, language: str):
+        """Returns the calling thread's parser for the language, as tree-sitter parsers can't be shared"""
+        from tree_sitter import Parser
+        from language_builder import create_ts_lang_obj
+
+        parsers = getattr(self.thread_state, "parsers", None)
+        if parsers is None:
+            parsers = self.thread_state.parsers = {}
+        if language not in parsers:
+            parser = Parser()
+            parser.set_language(create_ts_lang_obj(language))
+            parsers[language] = parser
+        return parsers[language]
+
+    def extract(self, language: str, src: bytes, name):
+        """Extracts and encodes the blocks of the source code, reading it from the file if it isn't given.
+        Runs in a worker thread."""
+        from feature_encoder import FeatureEncoder
+        from inference import lstm_max_length
+        from language_builder import create_ts_lang_obj
+
+        if src is None:
+            with open(name, "rb") as f:
+                src = f.read()
+        state = self.languages[language]
+        tree = self.parser(language).parse(src)
+        extractor = state["LangExtractor"](src, create_ts_lang_obj(language), tree, name, state["settings"])
+        param_vecs = extractor.fill_param_vectors(training=False)
+        if not param_vecs:
+            return [], None
+        blocks = [(par_vec["type"], par_vec["location"]) for par_vec in param_vecs]
+        X = state["encoder"].encode(param_vecs)
+        if self.settings.model != "rnd":
+            X = {"context": FeatureEncoder.encode_contexts([par_vec["context"] for par_vec in param_vecs],
+                                                           lstm_max_length),
+                 "other": X}
+        return blocks, X
+
+    async def recommend(self, request: dict) -> dict:
+        """
+        Handles a request for recommendations.
+        :param request: dict with either "path" of a source code file or "source" with the source code itself
+        and optionally its "name". The "language" is determined by the file's suffix if it isn't given.
+        :return: dict with the "file", its "recommendations" as a list of block types and lines,
+        and the recommendations formatted like the command line output as "lines"
+        """
+        if "source" in request:
+            # Lone surrogates, which JSON strings can contain, are replaced like undecodable bytes in files
+            src = request["source"].encode("utf8", errors="replace")
+            name = request.get("name", "<source>")
+        elif "path" in request:
+            src = None
+            name = request["path"]
+        else:
+            raise ValueError("Request contains neither path nor source")
+        language = request.get("language") or rev_suf.get(Path(name).suffix)
+        if language not in suf:
+            raise ValueError(f"Supported languages: {list(suf)}")
+        state = await self.language_state(language)
+        loop = asyncio.get_running_loop()
+        blocks, X = await loop.run_in_executor(None, self.extract, language, src, name)
+        predictions = await state["batcher"].predict(X) if X is not None else []
+        recommendations = []
+        lines = []
+        for (block_type, location), prediction in zip(blocks, predictions):
+            if prediction:
+                line = int(location.split("-")[0].split(";")[0])
+                recommendations.append({"type": block_type, "line": line})
+                lines.append(f"We recommend logging in the {block_type} starting in line {line}")
+        if lines:
+            lines.insert(0, f"File: {name}")
+        return {"file": str(name), "recommendations": recommendations, "lines": lines}
+
+    async def answer(self, line: bytes) -> bytes:
+        """Returns the response line to a request line"""
+        try:
+            response = await self.recommend(json.loads(line))
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        return json.dumps(response).encode("utf8") + b"\n"
+
+    async def handle_client(self, reader, writer):
+        """Answers the client's requests, one JSON object per line each.
+        Requests are handled concurrently, so the blocks of pipelined requests share batches,
+        and answered in the order they were received."""
+        answers = asyncio.Queue()
+
+        async def respond():
+            while (answer := await answers.get()) is not None:
+                writer.write(await answer)
+                await writer.drain()
+
+        responder = asyncio.create_task(respond())
+        try:
+            while line := await reader.readline():
+                await answers.put(asyncio.create_task(self.answer(line)))
+            await answers.put(None)
+            await responder
+        except ConnectionError:
+            responder.cancel()
+        finally:
+            writer.close()
+
+    async def serve(self, address: str):
+        """Listens on a Unix socket or localhost port until cancelled"""
+        kind, where = parse_address(address)
+        if kind == "tcp":
+            server = await asyncio.start_server(self.handle_client, *where)
+        else:
+            remove_stale_socket(where)
+            server = await asyncio.start_unix_server(self.handle_client, where)
+        # Load the models of the given language before the first request
+        if self.settings.language:
+            await self.language_state(self.settings.language)
+        print(f"Serving recommendations on {address}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def check_models(settings):
+    """
+    Checks that the models of the given language, or else of at least one language, are found in the working
+    directory, so the service doesn't start only to fail every request.
+    :raises RuntimeError: naming the paths looked at if no model is found
+    """
+    from inference import check_model
+
+    errors = []
+    for language in [settings.language] if settings.language else suf:
+        language_settings = copy(settings)
+        language_settings.language = language
+        try:
+            check_model(language_settings)
+            return
+        except RuntimeError as e:
+            errors.append(str(e))
+    raise RuntimeError("\n".join(errors))
+
+
+def serve(settings):
+    """Runs the recommendation service on settings.serve until interrupted"""
+    try:
+        asyncio.run(RecommendationService(settings).serve(settings.serve))
+    except KeyboardInterrupt:
+        pass
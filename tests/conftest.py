@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules of Logcheck are top-level modules in the repository's root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
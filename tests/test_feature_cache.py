@@ -0,0 +1,45 @@
+import argparse
+
+import logcheck
+from python_extractor import PythonExtractor
+
+source = b"""import logging
+
+
+def load(path):
+    if path:
+        for line in open(path):
+            try:
+                parse(line)
+            except ValueError:
+                logging.warning("Bad line")
+    return None
+"""
+
+
+def extraction_settings(model: str, cache_dir) -> argparse.Namespace:
+    return argparse.Namespace(language="python", model=model, alt=False, all=False, encode=False, debug=False,
+                              engine="query", cache_dir=cache_dir, profile=None, max_nodes=None)
+
+
+def extract(tmp_path, model: str, cache_dir=None) -> list:
+    file = tmp_path / "example.py"
+    file.write_bytes(source)
+    logcheck.init_worker(extraction_settings(model, cache_dir), PythonExtractor, False)
+    return logcheck.get_param_vecs(file, training=False)
+
+
+def contexts(param_vecs: list) -> list:
+    return [par_vec["context"] for par_vec in param_vecs]
+
+
+def test_switching_models_doesnt_reuse_entries_without_contexts(tmp_path):
+    cache_dir = tmp_path / "cache"
+    uncached = extract(tmp_path, "lstm")
+    # The random forest doesn't use the contexts, so they aren't built
+    extract(tmp_path, "rnd", cache_dir)
+    cached = extract(tmp_path, "lstm", cache_dir)
+    assert contexts(cached) == contexts(uncached)
+    assert all(context != "_" for context in contexts(cached))
+    # The entry written for the neural network is hit again
+    assert contexts(extract(tmp_path, "lstm", cache_dir)) == contexts(uncached)
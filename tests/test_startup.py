@@ -0,0 +1,70 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config import reindex
+
+repo_dir = Path(__file__).resolve().parent.parent
+# Dependencies that take seconds to import and are only needed for training and the neural network
+heavy_modules = ["pandas", "sklearn", "tensorflow"]
+# Seconds a run on a single file may take, which importing any of the heavy modules exceeds
+startup_budget = 1.0
+
+source = """import logging
+
+
+def f(x):
+    if x:
+        logging.info("x")
+        return 1
+    return 2
+"""
+
+# Runs a script like the interpreter does, printing the heavy modules loaded when the process exits
+report_modules = f"""import atexit, os, runpy, sys
+atexit.register(lambda: print("Heavy modules:", *[m for m in {heavy_modules!r} if m in sys.modules], file=sys.stderr))
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def save_stub_forest(path: Path):
+    """Saves a random forest export of a single leaf, so recommendation doesn't need a trained classifier"""
+    np.savez_compressed(path, feature=np.zeros(1, dtype=np.int32), threshold=np.full(1, np.inf, dtype=np.float32),
+                        child=np.zeros(1, dtype=np.int32), value=np.array([[1.0, 0.0]]),
+                        roots=np.zeros(1, dtype=np.int32), max_depth=np.array(1),
+                        n_features=np.array(len(reindex["python"])), classes=np.array([0, 1]))
+
+
+def run_logcheck(args: list, cwd: Path) -> tuple:
+    """Runs logcheck.py in a new process, returns its wall time in seconds and the heavy modules it loaded"""
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", report_modules, str(repo_dir / "logcheck.py"), *args], cwd=cwd,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+    assert process.returncode == 0, process.stderr
+    report = [line for line in process.stderr.splitlines() if line.startswith("Heavy modules:")]
+    return seconds, report[-1].split()[2:]
+
+
+def test_import_skips_heavy_modules():
+    process = subprocess.run([sys.executable, "-c", f"import sys; import logcheck; "
+                                                    f"print(*[m for m in {heavy_modules!r} if m in sys.modules])"],
+                             cwd=repo_dir, capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.split() == []
+
+
+def test_single_file_runs_within_budget(tmp_path):
+    (tmp_path / "example.py").write_text(source)
+    save_stub_forest(tmp_path / "python_logging_classifier.npz")
+    # The first run may build the grammar
+    run_logcheck(["-l", "python", "-e", "example.py"], tmp_path)
+    for args in [["-l", "python", "-e", "example.py"], ["-l", "python", "-m", "rnd", "example.py"]]:
+        seconds, modules = run_logcheck(args, tmp_path)
+        assert modules == [], args
+        assert seconds < startup_budget, args
@@ -0,0 +1,295 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+from tree_sitter import Parser, Tree
+
+# inotify event flags, see inotify(7)
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# Changes that complete writing a file, moving it in or out of a directory or deleting it
+watch_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+# struct inotify_event without the trailing name
+event_header = struct.Struct("iIII")
+
+logger = logging.getLogger("Logcheck")
+
+
+def files_below(directory: Path, suffix: str, walker=None):
+    """
+    Returns the files below a directory that the walker finds, or all files with the suffix without a walker.
+    Their sizes aren't checked, the changed files are checked with FileWalker.accepts() when they are reported.
+    """
+    if walker is None:
+        return directory.glob(f"**/*{suffix}")
+    return walker.walk(directory, check_size=False)
+
+
+def common_prefix_length(a: bytes, b: bytes) -> int:
+    """Returns the length of the longest common prefix of a and b"""
+    limit = min(len(a), len(b))
+    # Narrow down the first difference by comparing ever smaller slices, each comparison running in C
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def common_suffix_length(a: bytes, b: bytes, limit: int) -> int:
+    """Returns the length of the longest common suffix of a and b that is at most limit bytes long"""
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid:len(a) - low] == b[len(b) - mid:len(b) - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def point_at(src: bytes, byte: int) -> tuple:
+    """Returns tree-sitter's (row, column) point of a byte offset"""
+    row = src.count(b"\n", 0, byte)
+    return row, byte - (src.rfind(b"\n", 0, byte) + 1)
+
+
+def reparse(parser: Parser, tree: Tree, old_src: bytes, new_src: bytes) -> Tree:
+    """
+    Parses the new version of a file incrementally, reusing the unchanged parts of the old version's tree.
+    The difference between the versions is applied to the old tree as a single edit spanning all changed bytes.
+    Tree-sitter's error recovery can end up with a different tree when parsing incrementally, so if the new version
+    has syntax errors, it is parsed from scratch to get the same tree and features as without watch mode.
+    :param parser: parser set to the file's language
+    :param tree: tree of the old source code, edited in place
+    :param old_src: old source code
+    :param new_src: new source code
+    :return: tree of the new source code
+    """
+    start = common_prefix_length(old_src, new_src)
+    suffix = common_suffix_length(old_src, new_src, min(len(old_src), len(new_src)) - start)
+    old_end = len(old_src) - suffix
+    new_end = len(new_src) - suffix
+    tree.edit(
+        start_byte=start,
+        old_end_byte=old_end,
+        new_end_byte=new_end,
+        start_point=point_at(old_src, start),
+        old_end_point=point_at(old_src, old_end),
+        new_end_point=point_at(new_src, new_end),
+    )
+    new_tree = parser.parse(new_src, tree)
+    if new_tree.root_node.has_error:
+        return parser.parse(new_src)
+    return new_tree
+
+
+class InotifyWatcher:
+    """
+    Reports changed files below a directory using Linux' inotify, called through ctypes.
+    Subdirectories are watched as they are created. Directories that disappear before they are watched are skipped,
+    and if the system's limit of watches is reached while watching, changes are polled for instead.
+    """
+
+    def __init__(self, root: Path, suffix: str, walker=None, poll_interval: float = 0.5):
+        """
+        :param root: directory to watch recursively, or a single file whose directory is watched
+        :param suffix: file extension of the files to report
+        :param walker: FileWalker of root, if given only the directories it searches and the files it finds
+        are watched
+        :param poll_interval: seconds between scans when polling for changes
+        :raises OSError: if inotify isn't available or there are too many directories to watch
+        """
+        self.root = root
+        self.suffix = suffix
+        self.walker = walker
+        self.poll_interval = poll_interval
+        # PollingWatcher used instead once the limit of watches has been reached
+        self.polling = None
+        self.single_file = root if root.is_file() else None
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watched directory of each watch descriptor
+        self.directories = {}
+        try:
+            if self.single_file:
+                self.add_watch(root.parent)
+            else:
+                self.add_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, directory: Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), watch_mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(directory))
+        self.directories[wd] = directory
+
+    def add_tree(self, root: Path):
+        """
+        Watches a directory and its subdirectories, apart from those the walker skips.
+        Directories that can't be watched, e.g. because they have been deleted already, are skipped.
+        :raises OSError: if the limit of watches has been reached
+        """
+        if self.walker is not None and not self.walker.accepts_directory(root):
+            return
+        if not self.try_add_watch(root):
+            return
+        for dirpath, dirnames, filenames in os.walk(root):
+            if self.walker is not None:
+                dirnames[:] = [dirname for dirname in dirnames
+                               if self.walker.accepts_directory(Path(dirpath, dirname))]
+            dirnames[:] = [dirname for dirname in dirnames if self.try_add_watch(Path(dirpath, dirname))]
+
+    def try_add_watch(self, directory: Path) -> bool:
+        """Watches a directory, returns whether it is watched. Only raises OSError if the limit of watches is reached"""
+        try:
+            self.add_watch(directory)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            logger.warning(f"Can't watch {directory}: {e.strerror}")
+            return False
+        return True
+
+    def fall_back_to_polling(self):
+        """Polls for changes from now on, closing the inotify instance"""
+        logger.warning("Too many directories to watch with inotify, polling for changes instead. "
+                       "The limit is set in /proc/sys/fs/inotify/max_user_watches.")
+        self.polling = PollingWatcher(self.root, self.suffix, self.poll_interval, self.walker)
+        os.close(self.fd)
+
+    def read_events(self, changed: set):
+        """Adds the files of all pending events to the set of changed files"""
+        # The inotify instance is closed once polling for changes instead
+        while self.polling is None:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_length = event_header.unpack_from(data, offset)
+                offset += event_header.size
+                name = data[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                # Events have been lost, so report all files
+                if mask & IN_Q_OVERFLOW:
+                    changed.update([self.single_file] if self.single_file
+                                   else files_below(self.root, self.suffix, self.walker))
+                    continue
+                if mask & IN_IGNORED:
+                    self.directories.pop(wd, None)
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None or not name:
+                    continue
+                path = directory / os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    # Watch new directories, and report the files moved in with them
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not self.single_file:
+                        if self.polling is None:
+                            try:
+                                self.add_tree(path)
+                            except OSError:
+                                self.fall_back_to_polling()
+                        changed.update(files_below(path, self.suffix, self.walker))
+                elif path.suffix == self.suffix and (self.single_file is None or path == self.single_file):
+                    changed.add(path)
+
+    def wait(self, timeout: float = None, settle: float = 0.01) -> set:
+        """
+        Waits for changes and returns the changed files.
+        :param timeout: seconds to wait for a change, None to wait indefinitely
+        :param settle: seconds to wait for further events after the first one, so a save touching several files
+        is reported at once
+        """
+        if self.polling is not None:
+            return self.polling.wait(timeout)
+        changed = set()
+        if select.select([self.fd], [], [], timeout)[0]:
+            self.read_events(changed)
+            while self.polling is None and select.select([self.fd], [], [], settle)[0]:
+                self.read_events(changed)
+        return changed
+
+    def close(self):
+        if self.polling is None:
+            os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports changed files below a directory by periodically comparing their sizes and modification times"""
+
+    def __init__(self, root: Path, suffix: str, interval: float = 0.5, walker=None):
+        """
+        :param root: directory to watch recursively, or a single file
+        :param suffix: file extension of the files to report
+        :param interval: seconds between scans
+        :param walker: FileWalker of root, if given only the files it finds are watched
+        """
+        self.root = root
+        self.suffix = suffix
+        self.interval = interval
+        self.walker = walker
+        self.stats = self.scan()
+
+    def scan(self) -> dict:
+        files = [self.root] if self.root.is_file() else files_below(self.root, self.suffix, self.walker)
+        stats = {}
+        for file in files:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            stats[file] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def wait(self, timeout: float = None) -> set:
+        """Waits for changes and returns the changed files, see InotifyWatcher.wait()"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self.scan()
+            changed = {file for file in stats.keys() | self.stats.keys() if stats.get(file) != self.stats.get(file)}
+            self.stats = stats
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+def create_watcher(root: Path, suffix: str, poll_interval: float = 0.5, walker=None):
+    """Returns an inotify watcher, or a polling watcher where inotify isn't available, see InotifyWatcher for walker"""
+    try:
+        return InotifyWatcher(root, suffix, walker, poll_interval)
+    except (OSError, AttributeError):
+        return PollingWatcher(root, suffix, poll_interval, walker)
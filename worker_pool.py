@@ -0,0 +1,324 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+import profiler
+
+try:
+    import resource
+except ImportError:
+    # Memory limits are only available on Unix
+    resource = None
+
+logger = logging.getLogger("Logcheck")
+# Seconds between checks whether the thread handing out the chunks is stopped, while it waits for the workers
+stop_check_interval = 0.1
+
+
+def skip_file(skipped: list, file, reason: str):
+    """Records a file that is skipped and why"""
+    logger.warning(f"Skipping {file}: {reason}")
+    profiler.count("skipped_files")
+    skipped.append((file, reason))
+
+
+def work(connection, initializer, initargs, max_memory, log_level):
+    """
+    Main function of a worker process. Receives (task, chunk) messages and sends (index, result, error, profile)
+    for each file of the chunk as soon as it is done, then (None, None, None, profile) when the chunk is done.
+    A task's exception only skips its file, the error is sent instead of the result.
+    :param connection: the worker's end of the pipe to the pool
+    :param initializer: function called with initargs when the process starts
+    :param initargs: arguments of initializer
+    :param max_memory: maximum size of the process' address space in bytes, None for no limit
+    :param log_level: level of the parent's logging configuration, which processes that aren't forked don't inherit,
+    None if logging isn't configured
+    """
+    if log_level is not None:
+        logging.basicConfig(level=log_level)
+    initializer(*initargs)
+    # Limit the memory after the initializer, which may build the grammar with a compiler inheriting the limit
+    if max_memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        task, chunk = message
+        start = time.perf_counter()
+        for index, file in chunk:
+            try:
+                result, error = task(file), None
+            except Exception as e:
+                result, error = None, f"{type(e).__name__}: {e}"
+            connection.send((index, result, error, profiler.current.take() if profiler.current is not None else None))
+        if profiler.current is not None:
+            profiler.current.add_worker(os.getpid(), time.perf_counter() - start, len(chunk))
+        connection.send((None, None, None, profiler.current.take() if profiler.current is not None else None))
+
+
+class Worker:
+    """A worker process of a WorkerPool and the part of a chunk it hasn't finished yet"""
+
+    def __init__(self, initializer, initargs, max_memory, context=mp):
+        """:param context: multiprocessing context the process is started with"""
+        self.connection, child_connection = context.Pipe()
+        root = logging.getLogger()
+        log_level = root.level if root.handlers else None
+        self.process = context.Process(target=work, args=(child_connection, initializer, initargs, max_memory,
+                                                          log_level), daemon=True)
+        self.process.start()
+        child_connection.close()
+        # Remaining (index, file) of the chunk being worked on, None if idle
+        self.chunk = None
+        # Time the current file was started
+        self.started = None
+
+    def send(self, task, chunk: list):
+        self.chunk = deque(chunk)
+        self.started = time.monotonic()
+        self.connection.send((task, chunk))
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class WorkerPool:
+    """
+    Pool of worker processes that isolates the files from each other. A file whose task raises an exception,
+    runs longer than the time limit or crashes its worker process is skipped and recorded with the reason,
+    while the remaining files are worked on. Workers that crashed or were stopped for exceeding the time limit
+    are replaced, so the run continues with all workers. Replacements are started by a fork server, as forking
+    the thread handing out the chunks could copy locks other threads hold. The time limit covers code that can't be
+    interrupted, e.g. parsing with tree-sitter, as the worker process is killed.
+    Results are yielded in the order the files finish, see in_order() for the order of the files.
+    A thread hands out the chunks, so the workers keep working while the results are being used.
+    It holds at most max_results results for the caller, so the workers wait instead of the results piling up
+    in memory when they are used slower than they are produced.
+    """
+
+    def __init__(self, workers: int, initializer, initargs: tuple, skipped: list, file_timeout: float = None,
+                 max_memory: int = None, max_results: int = None):
+        """
+        :param workers: number of worker processes
+        :param initializer: function each worker process calls with initargs when it starts
+        :param initargs: arguments of initializer
+        :param skipped: list the skipped files are appended to as (file, reason)
+        :param file_timeout: seconds a worker may spend on a single file, None for no limit
+        :param max_memory: maximum size of each worker's address space in bytes, None for no limit
+        :param max_results: number of results waiting to be used at most, None for no limit
+        """
+        self.initializer = initializer
+        self.initargs = initargs
+        self.skipped = skipped
+        self.file_timeout = file_timeout
+        self.max_memory = max_memory
+        self.max_results = max_results
+        # Thread handing out the chunks of the current run and its queue of results, None when not running
+        self.dispatching = None
+        # Set to make the thread stop handing out chunks
+        self.stopping = threading.Event()
+        self.workers = [self.start_worker() for _ in range(workers)]
+        # The fork server isn't available on all platforms
+        self.replacement_context = mp.get_context(
+            "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+
+    def start_worker(self, context=mp) -> Worker:
+        return Worker(self.initializer, self.initargs, self.max_memory, context)
+
+    def receive(self, worker: Worker, results: queue.Queue):
+        """Passes the messages the worker has sent on to the results"""
+        while worker.chunk is not None and worker.connection.poll():
+            try:
+                index, result, error, recorded = worker.connection.recv()
+            except (EOFError, OSError):
+                return
+            # The chunk is done
+            if index is None:
+                worker.chunk = None
+                results.put((None, None, None, None, recorded))
+                return
+            _, file = worker.chunk.popleft()
+            worker.started = time.monotonic()
+            results.put((index, file, result, error, recorded))
+
+    def replace(self, worker: Worker, reason: str, requeued: deque, results: queue.Queue):
+        """Replaces a worker that crashed or was stopped, skipping the file it was working on
+        and requeueing the rest of its chunk. If it had already sent the results of all files, the chunk is done."""
+        worker.kill()
+        if worker.chunk:
+            index, file = worker.chunk.popleft()
+            results.put((index, file, None, reason, None))
+            if worker.chunk:
+                requeued.append(list(worker.chunk))
+        else:
+            results.put((None, None, None, None, None))
+        worker.chunk = None
+        self.workers[self.workers.index(worker)] = self.start_worker(self.replacement_context)
+
+    def dispatch(self, task, chunks, results: queue.Queue):
+        """
+        Hands out the chunks to idle workers and puts the messages of the workers into the results,
+        as well as the files skipped because their worker crashed or exceeded the time limit.
+        Puts None into the results when all chunks are done, or the exception if one occurs.
+        Runs in a thread of its own, so the workers are kept busy while the caller works on the results.
+        Returns without putting anything once stopping is set.
+        """
+        try:
+            chunks = iter(chunks)
+            # Rests of chunks whose worker was replaced
+            requeued = deque()
+            exhausted = False
+            while True:
+                if self.stopping.is_set():
+                    return
+                for i, worker in enumerate(self.workers):
+                    if worker.chunk is not None:
+                        continue
+                    if requeued:
+                        chunk = requeued.popleft()
+                    else:
+                        chunk = None if exhausted else next(chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                            break
+                    if not worker.process.is_alive():
+                        worker.kill()
+                        worker = self.workers[i] = self.start_worker(self.replacement_context)
+                    worker.send(task, chunk)
+                busy = [worker for worker in self.workers if worker.chunk is not None]
+                if not busy:
+                    break
+                timeout = stop_check_interval
+                if self.file_timeout is not None:
+                    timeout = min(timeout, max(0.0, min(worker.started for worker in busy) + self.file_timeout
+                                               - time.monotonic()))
+                wait([worker.connection for worker in busy] + [worker.process.sentinel for worker in busy], timeout)
+                for worker in busy:
+                    self.receive(worker, results)
+                    if worker.chunk is None:
+                        continue
+                    if not worker.process.is_alive():
+                        # The results sent before the crash have been received, the worker crashed on the next file
+                        exitcode = worker.process.exitcode
+                        if exitcode is not None and exitcode < 0:
+                            reason = f"the worker process was killed by {signal.Signals(-exitcode).name}"
+                        else:
+                            reason = f"the worker process exited with code {exitcode}"
+                        self.replace(worker, reason, requeued, results)
+                    elif self.file_timeout is not None and time.monotonic() - worker.started > self.file_timeout:
+                        self.replace(worker, f"exceeded the time limit of {self.file_timeout} seconds", requeued,
+                                     results)
+        except Exception as e:
+            results.put(e)
+        else:
+            results.put(None)
+
+    def run(self, task, chunks):
+        """
+        Runs the task on the files of the chunks, which are taken from the iterable as workers become idle.
+        :param task: function that is called with a file, must be picklable
+        :param chunks: iterable of lists of (index, file), see scheduler.schedule()
+        :return: generator of (index, file, result) in the order the files finish, with None as result of skipped files
+        """
+        results = queue.Queue(self.max_results or 0)
+        self.stopping.clear()
+        thread = threading.Thread(target=self.dispatch, args=(task, chunks, results), daemon=True)
+        self.dispatching = (thread, results)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                index, file, result, error, recorded = item
+                # The profiles recorded by the workers and the skipped files are collected in this thread
+                if recorded is not None and profiler.current is not None:
+                    profiler.current.merge(recorded)
+                if index is None:
+                    continue
+                if error is not None:
+                    skip_file(self.skipped, file, error)
+                yield index, file, result
+        finally:
+            # Also when the results aren't used up, e.g. after an exception while using them
+            self.stop_dispatch()
+
+    def stop_dispatch(self):
+        """Stops the thread handing out chunks if it is running, without waiting for the chunks being worked on"""
+        if self.dispatching is None:
+            return
+        thread, results = self.dispatching
+        self.dispatching = None
+        self.stopping.set()
+        # Make room for the results the thread is waiting to put, until it notices it is stopped
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+    def close(self):
+        """Stops the workers once they are idle. Workers still working on a chunk, e.g. of results that weren't used up,
+        are stopped immediately, as they may be waiting to send their results."""
+        self.stop_dispatch()
+        for worker in self.workers:
+            if worker.chunk is None:
+                worker.stop()
+        for worker in self.workers:
+            if worker.chunk is None:
+                worker.process.join()
+                worker.connection.close()
+            else:
+                worker.kill()
+
+    def terminate(self):
+        """Stops the workers immediately"""
+        self.stop_dispatch()
+        for worker in self.workers:
+            worker.kill()
+
+
+def run_in_process(task, files, skipped: list):
+    """
+    Runs the task on the files in this process, skipping the files whose task raises an exception like a WorkerPool.
+    :return: generator of (index, file, result), with None as result of skipped files
+    """
+    for index, file in enumerate(files):
+        try:
+            result = task(file)
+        except Exception as e:
+            result = None
+            skip_file(skipped, file, f"{type(e).__name__}: {e}")
+        yield index, file, result
+
+
+def in_order(results):
+    """Yields the (index, file, result) from a WorkerPool in the order of their indices, holding back results
+    that finish before those of earlier files"""
+    pending = {}
+    next_index = 0
+    for index, file, result in results:
+        pending[index] = (index, file, result)
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1